@@ -0,0 +1,252 @@
+"""Local stand-in for the parts of the Twilio REST API this app calls.
+
+Serves Accounts, Messages, Calls and IncomingPhoneNumbers with Twilio's JSON shapes,
+so the send paths can be exercised and benchmarked without a Twilio account.
+Every response can be delayed and a share of them can fail like Twilio does.
+
+>>> with FakeTwilioServer(latency=0.05, error_rate=0.01) as server, redirect_twilio_client(server.url):
+... 	Client('ACxxx', 'token').messages.create(to='whatsapp:+256770787451', from_='whatsapp:+14155238886', body='Hi')
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from email.utils import formatdate
+
+from werkzeug.routing import Map, Rule
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+from werkzeug.exceptions import HTTPException
+
+API_VERSION = '2010-04-01'
+# Hosts of every Twilio region and edge, e.g. https://api.dublin.ie1.twilio.com
+TWILIO_HOST = re.compile(r'^https://[a-z0-9.-]*\.twilio\.com')
+# Injected failures, as Twilio reports them.
+ERRORS = (
+	(429, 20429, 'Too Many Requests'),
+	(500, 20500, 'Internal Server Error'),
+	(503, 20503, 'Service Unavailable')
+)
+
+
+class FakeTwilioApp:
+	"""WSGI app answering Twilio REST requests from memory.
+	"""
+	def __init__(self, latency: float=0, jitter: float=0, error_rate: float=0):
+		"""
+		:param latency: seconds every response is delayed by
+		:param jitter: up to this many more seconds, picked at random per response
+		:param error_rate: share of requests, 0 to 1, answered with a Twilio error
+		"""
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.messages = {}
+		self.calls = {}
+		self.request_count = 0
+		self.error_count = 0
+		self._lock = threading.Lock()
+		self.url_map = Map([
+			Rule('/{}/Accounts/<account_sid>.json'.format(API_VERSION), endpoint='fetch_account', methods=['GET']),
+			Rule('/{}/Accounts/<account_sid>/Messages.json'.format(API_VERSION), endpoint='create_message', methods=['POST']),
+			Rule('/{}/Accounts/<account_sid>/Messages.json'.format(API_VERSION), endpoint='list_messages', methods=['GET']),
+			Rule('/{}/Accounts/<account_sid>/Messages/<sid>.json'.format(API_VERSION), endpoint='fetch_message', methods=['GET']),
+			Rule('/{}/Accounts/<account_sid>/Calls.json'.format(API_VERSION), endpoint='create_call', methods=['POST']),
+			Rule('/{}/Accounts/<account_sid>/Calls.json'.format(API_VERSION), endpoint='list_calls', methods=['GET']),
+			Rule('/{}/Accounts/<account_sid>/Calls/<sid>.json'.format(API_VERSION), endpoint='fetch_call', methods=['GET']),
+			Rule('/{}/Accounts/<account_sid>/Calls/<sid>.json'.format(API_VERSION), endpoint='update_call', methods=['POST']),
+			Rule('/{}/Accounts/<account_sid>/IncomingPhoneNumbers.json'.format(API_VERSION), endpoint='list_incoming_phone_numbers', methods=['GET']),
+		])
+
+	def __call__(self, environ, start_response):
+		request = Request(environ)
+		with self._lock:
+			self.request_count += 1
+
+		delay = self.latency + random.uniform(0, self.jitter)
+		if delay:
+			time.sleep(delay)
+
+		try:
+			endpoint, values = self.url_map.bind_to_environ(environ).match()
+		except HTTPException as e:
+			response = self.error_response(e.code, 20404, 'The requested resource {} was not found'.format(request.path))
+		else:
+			if self.error_rate and random.random() < self.error_rate:
+				response = self.error_response(*random.choice(ERRORS))
+			else:
+				response = getattr(self, endpoint)(request, **values)
+
+		if response.status_code >= 400:
+			with self._lock:
+				self.error_count += 1
+		return response(environ, start_response)
+
+	def json_response(self, payload: dict, status: int=200):
+		return Response(json.dumps(payload), status=status, mimetype='application/json')
+
+	def error_response(self, status: int, code: int, message: str):
+		return self.json_response({
+			'code': code,
+			'message': message,
+			'more_info': 'https://www.twilio.com/docs/errors/{}'.format(code),
+			'status': status
+		}, status=status)
+
+	def page(self, key: str, request, records: list):
+		"""A list page in Twilio's format, everything on the first page.
+		"""
+		return self.json_response({
+			key: records,
+			'page': 0,
+			'page_size': len(records),
+			'start': 0,
+			'end': max(len(records) - 1, 0),
+			'uri': request.full_path,
+			'first_page_uri': request.full_path,
+			'next_page_uri': None,
+			'previous_page_uri': None
+		})
+
+	def resource(self, prefix: str, account_sid: str, resource: str, **values):
+		now = formatdate(usegmt=True)
+		sid = prefix + uuid.uuid4().hex
+		return {
+			'sid': sid,
+			'account_sid': account_sid,
+			'api_version': API_VERSION,
+			'date_created': now,
+			'date_updated': now,
+			'uri': '/{}/Accounts/{}/{}/{}.json'.format(API_VERSION, account_sid, resource, sid),
+			**values
+		}
+
+	def fetch_account(self, request, account_sid):
+		return self.json_response({
+			'sid': account_sid,
+			'friendly_name': 'Fake Twilio Account',
+			'status': 'active',
+			'type': 'Full',
+			'uri': '/{}/Accounts/{}.json'.format(API_VERSION, account_sid)
+		})
+
+	def create_message(self, request, account_sid):
+		message = self.resource('SM', account_sid, 'Messages',
+			to=request.form.get('To'),
+			from_=request.form.get('From'),
+			body=request.form.get('Body'),
+			num_media=str(len(request.form.getlist('MediaUrl'))),
+			status='queued',
+			direction='outbound-api',
+			date_sent=None,
+			price=None,
+			error_code=None,
+			error_message=None
+		)
+		# Twilio's field is `from`, a keyword in Python.
+		message['from'] = message.pop('from_')
+		with self._lock:
+			self.messages[message['sid']] = message
+		return self.json_response(message, status=201)
+
+	def list_messages(self, request, account_sid):
+		return self.page('messages', request, list(self.messages.values()))
+
+	def fetch_message(self, request, account_sid, sid):
+		if sid not in self.messages:
+			return self.error_response(404, 20404, 'The requested resource was not found')
+		return self.json_response(self.messages[sid])
+
+	def create_call(self, request, account_sid):
+		call = self.resource('CA', account_sid, 'Calls',
+			to=request.form.get('To'),
+			from_=request.form.get('From'),
+			status='queued',
+			direction='outbound-api',
+			duration=None,
+			start_time=None,
+			end_time=None
+		)
+		call['from'] = call.pop('from_')
+		with self._lock:
+			self.calls[call['sid']] = call
+		return self.json_response(call, status=201)
+
+	def list_calls(self, request, account_sid):
+		return self.page('calls', request, list(self.calls.values()))
+
+	def fetch_call(self, request, account_sid, sid):
+		if sid not in self.calls:
+			return self.error_response(404, 20404, 'The requested resource was not found')
+		return self.json_response(self.calls[sid])
+
+	def update_call(self, request, account_sid, sid):
+		"""Redirects (`Url`) and hang ups (`Status`) of calls, calls not placed here are made up on the spot
+		as they were received by the webhooks being benchmarked.
+		"""
+		with self._lock:
+			call = self.calls.setdefault(sid, {
+				**self.resource('CA', account_sid, 'Calls', status='in-progress', direction='inbound'),
+				'sid': sid
+			})
+			if request.form.get('Status'):
+				call['status'] = request.form['Status']
+		return self.json_response(call)
+
+	def list_incoming_phone_numbers(self, request, account_sid):
+		return self.page('incoming_phone_numbers', request, [{
+			'sid': 'PN' + uuid.uuid4().hex,
+			'account_sid': account_sid,
+			'phone_number': '+15005550006',
+			'friendly_name': '(500) 555-0006',
+			'capabilities': {'voice': True, 'sms': True, 'mms': True}
+		}])
+
+
+class FakeTwilioServer:
+	"""Serve a `FakeTwilioApp` from a background thread, on a free port unless one is given.
+	"""
+	def __init__(self, host: str='127.0.0.1', port: int=0, **options):
+		self.app = FakeTwilioApp(**options)
+		self.server = make_server(host, port, self.app, threaded=True)
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+	@property
+	def url(self):
+		return 'http://{}:{}'.format(self.server.server_address[0], self.server.server_port)
+
+	def start(self):
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.thread.join()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+
+@contextmanager
+def redirect_twilio_client(base_url: str):
+	"""Send the requests of every Twilio REST client in this process to `base_url`.
+	Works below the app, so the send paths being measured run unchanged.
+	"""
+	from twilio.http.http_client import TwilioHttpClient
+
+	request = TwilioHttpClient.request
+
+	def redirected_request(self, method, url, *args, **kwargs):
+		return request(self, method, TWILIO_HOST.sub(base_url, url), *args, **kwargs)
+
+	TwilioHttpClient.request = redirected_request
+	try:
+		yield
+	finally:
+		TwilioHttpClient.request = request
@@ -0,0 +1,246 @@
+"""Throughput of the webhooks and send paths, with Twilio replaced by the local fake API.
+
+Webhooks are requested through Frappe's full request cycle from a pool of threads,
+as gunicorn's threaded workers would serve them. Campaigns are sent in process.
+Run from the bench's `sites` directory against a site kept for benchmarking:
+Twilio Settings and whatsapp integration settings need to be enabled, with any
+credentials, and the records created here are left behind.
+
+	python -m twilio_integration.benchmarks.run --site bench.localhost --requests 2000 --concurrency 16 --latency 0.1
+"""
+import argparse
+import json
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import frappe
+from werkzeug.test import Client
+
+from .fake_twilio import FakeTwilioServer, redirect_twilio_client
+
+BENCHMARKS = ('campaign', 'chatbot', 'order_webhook', 'status_callback', 'voice')
+CHATBOT_PATH = '/api/method/twilio_integration.services.whatsapp_order_chatbot.handle_whatsapp_chatbot'
+ORDER_WEBHOOK_PATH = '/api/method/twilio_integration.twilio_integration.api.whatsapp_orders.handle_order_webhook'
+STATUS_CALLBACK_PATH = '/api/method/twilio_integration.twilio_integration.api.whatsapp_messages.whatsapp_message_status_callback'
+VOICE_PATH = '/api/method/twilio_integration.twilio_integration.api.voice.voice'
+# Status callbacks replayed for every message sent, in the order Twilio reports them.
+MESSAGE_STATUSES = ('sent', 'delivered', 'read')
+BENCHMARK_TEMPLATE = 'Benchmark'
+# Campaign recipients need an existing record to link to, numbers are read from the rows.
+RECIPIENT_DOCTYPE = 'User'
+RECIPIENT = 'Administrator'
+
+
+class BenchmarkResult:
+	def __init__(self, name: str, latencies: list, errors: int, elapsed: float, count: int=None, unit: str='requests'):
+		"""
+		:param latencies: seconds taken by each request
+		:param count: units of work done, the number of requests unless given
+		"""
+		self.name = name
+		self.latencies = sorted(latencies)
+		self.errors = errors
+		self.elapsed = elapsed
+		self.count = len(latencies) if count is None else count
+		self.unit = unit
+
+	@property
+	def rate(self):
+		return self.count / self.elapsed if self.elapsed else 0
+
+	def percentile(self, percent: float):
+		"""Nearest-rank percentile of the latencies, in milliseconds.
+		"""
+		if not self.latencies:
+			return 0
+		rank = max(math.ceil(percent / 100 * len(self.latencies)) - 1, 0)
+		return self.latencies[rank] * 1000
+
+	def as_row(self):
+		return (self.name, len(self.latencies), self.errors, '{:.1f} {}/s'.format(self.rate, self.unit),
+			'{:.1f}'.format(self.percentile(50)), '{:.1f}'.format(self.percentile(99)))
+
+
+def get_number(i: int):
+	"""Distinct valid mobile numbers, so that recipients are neither deduplicated nor rejected.
+	"""
+	return '+25677{:07d}'.format(i)
+
+@contextmanager
+def site_connection(site: str):
+	frappe.init(site=site, sites_path='.')
+	frappe.connect()
+	frappe.set_user('Administrator')
+	try:
+		yield
+	finally:
+		frappe.destroy()
+
+def run_requests(name: str, site: str, requests: list, concurrency: int):
+	"""POST every request, `(path, kwargs of werkzeug's Client.post)`, from `concurrency` threads.
+	"""
+	from frappe.app import application
+
+	def _post(request):
+		path, kwargs = request
+		start = time.perf_counter()
+		response = Client(application).post(path, headers={'X-Frappe-Site-Name': site}, **kwargs)
+		return time.perf_counter() - start, response.status_code >= 400
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		outcomes = list(executor.map(_post, requests))
+	elapsed = time.perf_counter() - start
+
+	return BenchmarkResult(name, [latency for latency, _ in outcomes], sum(failed for _, failed in outcomes), elapsed)
+
+def run_campaign(size: int, runs: int):
+	"""Send `runs` campaigns of `size` recipients each through `WhatsAppCampaign.send_now`.
+	Latencies are per campaign, the rate is in messages.
+	"""
+	if not frappe.db.exists('WhatsApp Message Template', BENCHMARK_TEMPLATE):
+		frappe.get_doc({
+			'doctype': 'WhatsApp Message Template',
+			'template_name': BENCHMARK_TEMPLATE,
+			'message': 'Benchmark message'
+		}).insert()
+
+	latencies, errors = [], 0
+	for _ in range(runs):
+		campaign = frappe.get_doc({
+			'doctype': 'WhatsApp Campaign',
+			'template_name': BENCHMARK_TEMPLATE,
+			'message': 'Benchmark message',
+			'audience_type': 'Recipients',
+			'recipients': [{
+				'campaign_for': RECIPIENT_DOCTYPE,
+				'recipient': RECIPIENT,
+				'whatsapp_no': get_number(i)
+			} for i in range(size)]
+		}).insert()
+		frappe.db.commit()
+
+		start = time.perf_counter()
+		try:
+			campaign.send_now()
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			errors += 1
+		latencies.append(time.perf_counter() - start)
+
+	return BenchmarkResult('campaign', latencies, errors, sum(latencies), count=size * runs, unit='messages')
+
+def get_webhook_requests(benchmark: str, count: int, senders: int, messages: list, settings):
+	"""Payloads for `count` requests to a webhook, as Twilio would send them.
+	"""
+	if benchmark == 'chatbot':
+		return [(CHATBOT_PATH, {'data': {
+			'Body': 'hi',
+			'From': 'whatsapp:' + get_number(i % senders)
+		}}) for i in range(count)]
+
+	if benchmark == 'order_webhook':
+		return [(ORDER_WEBHOOK_PATH, {'content_type': 'application/json', 'data': json.dumps({
+			'Body': 'hi',
+			'From': 'whatsapp:' + get_number(i % senders)
+		})}) for i in range(count)]
+
+	if benchmark == 'status_callback':
+		# Messages sent by the campaign benchmark, made up when it wasn't run.
+		messages = messages or [{
+			'sid': 'SM' + uuid.uuid4().hex,
+			'from': 'whatsapp:' + settings.whatsapp_from,
+			'to': 'whatsapp:' + get_number(i)
+		} for i in range(senders)]
+		callbacks = [(message, status) for status in MESSAGE_STATUSES for message in messages][:count]
+		return [(STATUS_CALLBACK_PATH, {'data': {
+			'MessageSid': message['sid'],
+			'From': message['from'],
+			'To': message['to'],
+			'MessageStatus': status
+		}}) for message, status in callbacks]
+
+	if benchmark == 'voice':
+		return [(VOICE_PATH, {'data': {
+			'AccountSid': settings.account_sid,
+			'ApplicationSid': settings.application_sid,
+			'CallSid': 'CA' + uuid.uuid4().hex,
+			'Caller': 'client:' + settings.agent_identity,
+			'To': get_number(i % senders),
+			'Direction': 'inbound'
+		}}) for i in range(count)]
+
+def get_settings(agent: str):
+	from twilio_integration.twilio_integration.twilio_handler import Twilio
+
+	twilio_settings = frappe.get_cached_doc('Twilio Settings')
+	return frappe._dict({
+		'account_sid': twilio_settings.account_sid,
+		'application_sid': twilio_settings.twiml_sid,
+		'whatsapp_from': frappe.db.get_single_value('whatsapp integration settings', 'twilio_number'),
+		'agent_identity': Twilio.safe_identity(agent)
+	})
+
+def run(site: str, benchmarks=BENCHMARKS, requests: int=1000, concurrency: int=8, senders: int=100,
+	campaign_size: int=1000, campaign_runs: int=3, latency: float=0, jitter: float=0, error_rate: float=0,
+	agent: str='Administrator'):
+	"""Run the benchmarks in the order of `BENCHMARKS`, the campaign first so its messages get status callbacks.
+	"""
+	results = []
+	with FakeTwilioServer(latency=latency, jitter=jitter, error_rate=error_rate) as server, \
+		redirect_twilio_client(server.url):
+		with site_connection(site):
+			settings = get_settings(agent)
+			if 'campaign' in benchmarks:
+				results.append(run_campaign(campaign_size, campaign_runs))
+
+		messages = list(server.app.messages.values())
+		for benchmark in BENCHMARKS:
+			if benchmark != 'campaign' and benchmark in benchmarks:
+				results.append(run_requests(benchmark, site,
+					get_webhook_requests(benchmark, requests, senders, messages, settings), concurrency))
+
+	print_results(results, server.app)
+	return results
+
+def print_results(results: list, fake_twilio):
+	rows = [('benchmark', 'requests', 'errors', 'throughput', 'p50 ms', 'p99 ms')] + [result.as_row() for result in results]
+	widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+	for row in rows:
+		print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
+	print('\nTwilio API requests: {}, failed: {}'.format(fake_twilio.request_count, fake_twilio.error_count))
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark Twilio Integration webhooks against a fake Twilio API.')
+	parser.add_argument('--site', required=True)
+	parser.add_argument('--only', default=','.join(BENCHMARKS), help='comma separated, out of {}'.format(', '.join(BENCHMARKS)))
+	parser.add_argument('--requests', type=int, default=1000, help='requests per webhook')
+	parser.add_argument('--concurrency', type=int, default=8, help='webhook requests in flight')
+	parser.add_argument('--senders', type=int, default=100, help='distinct numbers the webhook requests come from')
+	parser.add_argument('--campaign-size', type=int, default=1000, help='recipients per campaign')
+	parser.add_argument('--campaign-runs', type=int, default=3)
+	parser.add_argument('--latency', type=float, default=0, help='seconds the fake Twilio API takes per request')
+	parser.add_argument('--jitter', type=float, default=0, help='up to this many more seconds, at random')
+	parser.add_argument('--error-rate', type=float, default=0, help='share of Twilio API requests that fail, 0 to 1')
+	parser.add_argument('--agent', default='Administrator', help='user placing the benchmarked outgoing calls')
+	args = parser.parse_args()
+
+	run(args.site,
+		benchmarks=[benchmark.strip() for benchmark in args.only.split(',')],
+		requests=args.requests,
+		concurrency=args.concurrency,
+		senders=args.senders,
+		campaign_size=args.campaign_size,
+		campaign_runs=args.campaign_runs,
+		latency=args.latency,
+		jitter=args.jitter,
+		error_rate=args.error_rate,
+		agent=args.agent
+	)
+
+if __name__ == '__main__':
+	main()
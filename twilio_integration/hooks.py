@@ -134,6 +134,26 @@ doc_events = {
 	"before_submit": "twilio_integration.services.whatsapp_workflow.send_approval_confirmation"
 
     },
+    "DocType": {
+        "on_update": "twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.clear_whatsapp_doctypes",
+        "on_trash": "twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.clear_whatsapp_doctypes"
+    },
+    "Custom Field": {
+        "on_update": "twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.clear_whatsapp_doctypes",
+        "on_trash": "twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.clear_whatsapp_doctypes"
+    },
+    "Contact": {
+        "on_update": "twilio_integration.twilio_integration.caller_lookup.clear_caller_summary",
+        "on_trash": "twilio_integration.twilio_integration.caller_lookup.clear_caller_summary"
+    },
+    "User": {
+        "on_update": "twilio_integration.twilio_integration.api.notifications.clear_users_by_number",
+        "on_trash": "twilio_integration.twilio_integration.api.notifications.clear_users_by_number"
+    },
+    "Employee": {
+        "on_update": "twilio_integration.twilio_integration.api.notifications.clear_users_by_number",
+        "on_trash": "twilio_integration.twilio_integration.api.notifications.clear_users_by_number"
+    },
     "WhatsApp Order Session": {
         "validate": "twilio_integration.services.whatsapp_order_chatbot.validate_session",
         "on_update": "twilio_integration.services.whatsapp_order_chatbot.on_session_update"
@@ -144,12 +164,29 @@ doc_events = {
 # ---------------
 
 scheduler_events = {
+	"all": [
+		"twilio_integration.twilio_integration.call_log.consume_call_events"
+	],
+	"cron": {
+		"* * * * *": [
+			"twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.launch_scheduled_campaigns",
+			"twilio_integration.twilio_integration.outbound.send_due_messages"
+		],
+		"*/5 * * * *": [
+			"twilio_integration.twilio_integration.campaign_stats.rollup_campaign_counters",
+			"twilio_integration.twilio_integration.approval_digest.send_approval_digests"
+		],
+		"*/10 * * * *": [
+			"twilio_integration.twilio_integration.call_log.reconcile_open_calls"
+		]
+	},
 	"daily": [
         "twilio_integration.services.whatsapp_order_chatbot.cleanup_old_sessions"
     ],
 	"hourly": [
 		"twilio_integration.twilio_integration.doctype.twilio_settings.twilio_settings.cleanup_expired_sessions",
-		"twilio_integration.services.whatsapp_order_chatbot.cleanup_inactive_sessions"
+		"twilio_integration.services.whatsapp_order_chatbot.cleanup_inactive_sessions",
+		"twilio_integration.twilio_integration.media.purge_expired_media"
 	]
 }
 
@@ -2,6 +2,8 @@ import frappe
 from frappe import _
 from frappe.email.doctype.notification.notification import Notification, get_context, json
 from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import WhatsAppMessage
+from twilio_integration.twilio_integration.message_templates import MessageTemplate
+from twilio_integration.twilio_integration.outbound import NOTIFICATION
 
 class SendNotification(Notification):
 	def validate(self):
@@ -30,9 +32,27 @@ class SendNotification(Notification):
 		super(SendNotification, self).send(doc)
 
 	def send_whatsapp_msg(self, doc, context):
-		WhatsAppMessage.send_whatsapp_message(
-			receiver_list=self.get_receiver_list(doc, context),
-			message=frappe.render_template(self.message, context),
-			doctype = self.doctype,
-			docname = self.name
-		)
\ No newline at end of file
+		# Nothing is sent for a save that is rolled back, and the save doesn't wait on Twilio.
+		frappe.db.after_commit.add(lambda: self.enqueue_whatsapp_msg(doc, context))
+
+	def enqueue_whatsapp_msg(self, doc, context):
+		"""Render with the document as committed and hand the send to a worker.
+		"""
+		try:
+			frappe.enqueue(
+				'twilio_integration.overrides.notification.send_whatsapp_notification',
+				receiver_list=self.get_receiver_list(doc, context),
+				message=MessageTemplate.for_doc(self).render(context),
+				notification=self.name
+			)
+		except Exception:
+			frappe.log_error(title='Failed to send notification', message=frappe.get_traceback())
+
+def send_whatsapp_notification(receiver_list, message, notification):
+	WhatsAppMessage.send_whatsapp_message(
+		receiver_list=receiver_list,
+		message=message,
+		doctype = 'Notification',
+		docname = notification,
+		source = NOTIFICATION
+	)
\ No newline at end of file
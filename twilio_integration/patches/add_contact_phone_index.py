@@ -0,0 +1,6 @@
+import frappe
+
+def execute():
+	"""Caller lookups match `Contact Phone` rows on the exact number, index it.
+	"""
+	frappe.db.add_index("Contact Phone", ["phone"])
@@ -0,0 +1,38 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+def execute():
+	"""Digest settings of `WhatsApp Workflow Configuration`, on sites that have the doctype.
+	"""
+	if not frappe.db.exists("DocType", "WhatsApp Workflow Configuration"):
+		return
+
+	create_custom_fields({
+		"WhatsApp Workflow Configuration": [
+			{
+				"fieldname": "digest_mode",
+				"fieldtype": "Check",
+				"label": "Send as Digest",
+				"description": "Instead of a message per document, send each approver their pending documents in one message at the digest interval",
+				"default": 0,
+				"insert_after": "amount_field"
+			},
+			{
+				"fieldname": "digest_interval",
+				"fieldtype": "Int",
+				"label": "Digest Interval (Minutes)",
+				"default": 60,
+				"depends_on": "digest_mode",
+				"insert_after": "digest_mode"
+			},
+			{
+				"fieldname": "last_digest_sent",
+				"fieldtype": "Datetime",
+				"label": "Last Digest Sent",
+				"read_only": 1,
+				"no_copy": 1,
+				"depends_on": "digest_mode",
+				"insert_after": "digest_interval"
+			}
+		]
+	}, update=True)
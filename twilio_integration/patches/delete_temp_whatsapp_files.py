@@ -0,0 +1,14 @@
+import glob
+import os
+
+from frappe.utils import get_site_path
+
+def execute():
+	"""Media used to be written to `public/files` as `temp_whatsapp_*.pdf` and never removed.
+	Staged media is purged on schedule now, delete what the old code left behind.
+	"""
+	for file_path in glob.glob(get_site_path("public", "files", "temp_whatsapp_*.pdf")):
+		try:
+			os.remove(file_path)
+		except FileNotFoundError:
+			pass
@@ -2,6 +2,12 @@ var onload_script = function() {
 	frappe.provide('frappe.phone_call');
 	frappe.provide('frappe.twilio_conn_dialog_map')
 	let device;
+	const token_storage_key = `twilio_voice_token:${frappe.session.user}`;
+	// Keep well below PRESENCE_TTL in presence.py
+	const heartbeat_interval = 30 * 1000;
+	// Presence is kept per tab, closing one tab leaves the agent online in the others.
+	const presence_tab = frappe.utils.get_random(10);
+	let heartbeat;
 
 	if (frappe.boot.twilio_enabled){
 		frappe.run_serially([
@@ -10,84 +16,159 @@ var onload_script = function() {
 		]);
 	}
 
+	function get_stored_token() {
+		const stored = JSON.parse(localStorage.getItem(token_storage_key) || 'null');
+		if (stored && stored.refresh_at > Date.now()) {
+			return stored;
+		}
+	}
+
+	function fetch_access_token() {
+		return frappe.call({
+			method: "twilio_integration.twilio_integration.api.voice.generate_access_token"
+		}).then((data) => {
+			// No token when Twilio isn't configured.
+			if (!(data.message && data.message.token)) {
+				return null;
+			}
+			// The server decides how far ahead of expiry the token is refreshed.
+			const token = {
+				token: data.message.token,
+				refresh_at: Date.now() + data.message.refresh_in * 1000
+			};
+			localStorage.setItem(token_storage_key, JSON.stringify(token));
+			return token;
+		});
+	}
+
+	function get_access_token() {
+		const stored = get_stored_token();
+		return stored ? Promise.resolve(stored) : fetch_access_token();
+	}
+
+	function schedule_token_refresh(token) {
+		// Swap in a fresh token ahead of expiry instead of waiting for a page load.
+		setTimeout(() => {
+			fetch_access_token().then((new_token) => {
+				if (!new_token) return;
+				device.updateToken(new_token.token);
+				schedule_token_refresh(new_token);
+			});
+		}, Math.max(token.refresh_at - Date.now(), 0));
+	}
+
 	function setup_device() {
-		frappe.call( {
-			method: "twilio_integration.twilio_integration.api.generate_access_token",
-			callback: (data) => {
-				device = new Twilio.Device(data.message.token, {
-					codecPreferences: ["opus", "pcmu"],
-					fakeLocalDTMF: true,
-					enableRingingState: true,
-				});
-
-				device.on("ready", function (device) {
-					Object.values(frappe.twilio_conn_dialog_map).forEach(function(popup){
-						popup.set_header('available');
-					})
-				});
-
-				device.on("error", function (error) {
-					Object.values(frappe.twilio_conn_dialog_map).forEach(function(popup){
-						popup.set_header('Failed');
-					})
-					device.disconnectAll();
-					console.log("Twilio Device Error:" + error.message);
-				});
-
-				device.on("disconnect", function (conn) {
-					update_call_log(conn);
-					const popup = frappe.twilio_conn_dialog_map[conn];
-					// Reomove the connection from map object
-					delete frappe.twilio_conn_dialog_map[conn]
-					popup.dialog.enable_primary_action();
-					popup.show_close_button();
-					window.onbeforeunload = null;
-					popup.set_header("available");
-					popup.hide_mute_button();
-					popup.hide_hangup_button();
-					popup.hide_dial_icon();
-					popup.hide_dialpad();
-					// Make sure that dialog is closed when incoming call is disconnected.
-					if (conn.direction == 'INCOMING'){
-						popup.close();
-					}
-				});
-
-				device.on("cancel", function () {
-					Object.values(frappe.twilio_conn_dialog_map).forEach(function(popup){
-						popup.close();
-					})
-				});
-
-				device.on("connect", function (conn) {
-					const popup = frappe.twilio_conn_dialog_map[conn];
-					popup.setup_mute_button(conn);
-					popup.dialog.set_secondary_action_label("Hang Up")
-					popup.set_header("in-progress");
-					window.onbeforeunload = function() {
-						return "you can not refresh the page";
+		get_access_token().then((token) => {
+			if (!token) return;
+			device = new Twilio.Device(token.token, {
+				codecPreferences: ["opus", "pcmu"],
+				fakeLocalDTMF: true,
+				enableRingingState: true,
+			});
+			schedule_token_refresh(token);
+
+			device.on("ready", function (device) {
+				Object.values(frappe.twilio_conn_dialog_map).forEach(function(popup){
+					popup.set_header('available');
+				})
+				start_heartbeat();
+			});
+
+			device.on("offline", function () {
+				stop_heartbeat();
+			});
+
+			device.on("error", function (error) {
+				Object.values(frappe.twilio_conn_dialog_map).forEach(function(popup){
+					popup.set_header('Failed');
+				})
+				device.disconnectAll();
+				stop_heartbeat();
+				console.log("Twilio Device Error:" + error.message);
+			});
+
+			device.on("disconnect", function (conn) {
+				update_call_log(conn);
+				const popup = frappe.twilio_conn_dialog_map[conn];
+				// Reomove the connection from map object
+				delete frappe.twilio_conn_dialog_map[conn]
+				popup.dialog.enable_primary_action();
+				popup.show_close_button();
+				window.onbeforeunload = null;
+				popup.set_header("available");
+				popup.hide_mute_button();
+				popup.hide_hangup_button();
+				popup.hide_dial_icon();
+				popup.hide_dialpad();
+				// Make sure that dialog is closed when incoming call is disconnected.
+				if (conn.direction == 'INCOMING'){
+					popup.close();
+				}
+			});
+
+			device.on("cancel", function () {
+				Object.values(frappe.twilio_conn_dialog_map).forEach(function(popup){
+					popup.close();
+				})
+			});
+
+			device.on("connect", function (conn) {
+				const popup = frappe.twilio_conn_dialog_map[conn];
+				popup.setup_mute_button(conn);
+				popup.dialog.set_secondary_action_label("Hang Up")
+				popup.set_header("in-progress");
+				window.onbeforeunload = function() {
+					return "you can not refresh the page";
+				}
+				popup.setup_dial_icon();
+				popup.setup_dialpad(conn);
+				document.onkeydown = (e) => {
+					if (popup.dialog.$wrapper.find('.dialpad-section').is(":hidden")) return;
+					let key = e.key;
+					if (conn.status() == 'open' && ["0","1", "2", "3", "4", "5", "6", "7", "8", "9", "*", "#", "w"].includes(key)) {
+						conn.sendDigits(key);
+						popup.update_dialpad_input(key);
 					}
-					popup.setup_dial_icon();
-					popup.setup_dialpad(conn);
-					document.onkeydown = (e) => {
-						if (popup.dialog.$wrapper.find('.dialpad-section').is(":hidden")) return;
-						let key = e.key;
-						if (conn.status() == 'open' && ["0","1", "2", "3", "4", "5", "6", "7", "8", "9", "*", "#", "w"].includes(key)) {
-							conn.sendDigits(key);
-							popup.update_dialpad_input(key);
-						}
-					};
-				});
-
-				device.on("incoming", function (conn) {
-					console.log("Incoming connection from " + conn.parameters.From);
-					call_screen(conn);
-				});
+				};
+			});
 
-			}
+			device.on("incoming", function (conn) {
+				console.log("Incoming connection from " + conn.parameters.From);
+				call_screen(conn);
+			});
 		});
 	}
 
+	function send_presence(status) {
+		frappe.call({
+			method: "twilio_integration.twilio_integration.api.voice.update_agent_presence",
+			args: { status: status, tab: presence_tab }
+		});
+	}
+
+	function start_heartbeat() {
+		// Incoming calls are only routed to agents whose softphone keeps reporting in.
+		if (heartbeat) return;
+		send_presence('online');
+		heartbeat = setInterval(() => send_presence('online'), heartbeat_interval);
+	}
+
+	function stop_heartbeat() {
+		if (!heartbeat) return;
+		clearInterval(heartbeat);
+		heartbeat = null;
+		send_presence('offline');
+	}
+
+	window.addEventListener('pagehide', () => {
+		if (!heartbeat) return;
+		const data = new FormData();
+		data.append('status', 'offline');
+		data.append('tab', presence_tab);
+		data.append('csrf_token', frappe.csrf_token);
+		navigator.sendBeacon('/api/method/twilio_integration.twilio_integration.api.voice.update_agent_presence', data);
+	});
+
 	function dialer_screen() {
 		frappe.phone_call.handler = (to_number, frm) => {
 			let to_numbers;
@@ -106,7 +187,7 @@ var onload_script = function() {
 	function update_call_log(conn, status="Completed") {
 		if (!conn.parameters.CallSid) return
 		frappe.call({
-			"method": "twilio_integration.twilio_integration.api.update_call_log",
+			"method": "twilio_integration.twilio_integration.api.voice.update_call_log",
 			"args": {
 				"call_sid": conn.parameters.CallSid,
 				"status": status
@@ -117,7 +198,7 @@ var onload_script = function() {
 	function call_screen(conn) {
 		frappe.call({
 			type: "GET",
-			method: "twilio_integration.twilio_integration.api.get_contact_details",
+			method: "twilio_integration.twilio_integration.api.voice.get_contact_details",
 			args: {
 				'phone': conn.parameters.From
 			},
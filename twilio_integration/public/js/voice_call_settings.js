@@ -7,7 +7,7 @@ frappe.ui.form.on('Voice Call Settings', {
 	},
 	refresh: function(frm) {
 		frappe.call({
-			method: "twilio_integration.twilio_integration.api.get_twilio_phone_numbers",
+			method: "twilio_integration.twilio_integration.api.voice.get_twilio_phone_numbers",
 			callback: function(resp) {
 				if (resp.message.length) {
 					frm.set_df_property('twilio_number', 'options', resp.message);
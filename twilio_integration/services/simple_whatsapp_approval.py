@@ -2,6 +2,7 @@
 import frappe
 from twilio.rest import Client
 import hashlib
+from twilio_integration.twilio_integration.outbound import queue_outbound_message, SALES_ORDER_APPROVAL
 
 # Your credentials
 STATIC_TWILIO_SID = "AC7b3d98150c02344e32fa5550a488aeda"
@@ -35,8 +36,6 @@ def send_simple_approval_message(phone, doc, token):
         if not phone.startswith('+'):
             phone = '+' + phone
             
-        client = Client(STATIC_TWILIO_SID, STATIC_TWILIO_TOKEN)
-        
         # Create simple, clear message
         message_text = f"""🔔 Sales Order Approval Required
 
@@ -52,20 +51,29 @@ Please reply with one of these:
 
 Just copy and send one of the options above."""
         
+        if queue_outbound_message(phone, message_text, SALES_ORDER_APPROVAL, doc.doctype, doc.name):
+            return
+        
         # Send the message
-        message = client.messages.create(
-            body=message_text,
-            from_=f"whatsapp:{STATIC_WHATSAPP_FROM}",
-            to=f"whatsapp:{phone}"
-        )
+        message_sid = send_whatsapp_text(phone, message_text)
         
-        frappe.log_error(f"Approval message sent - SID: {message.sid}, Token: {token}", "Message Sent")
-        return message.sid
+        frappe.log_error(f"Approval message sent - SID: {message_sid}, Token: {token}", "Message Sent")
+        return message_sid
         
     except Exception as e:
         frappe.log_error(f"Send error: {str(e)}", "Send Error")
         raise e
 
+def send_whatsapp_text(phone, message_text):
+    """Send a message from the approval number, also used for coalesced approval messages"""
+    client = Client(STATIC_TWILIO_SID, STATIC_TWILIO_TOKEN)
+    message = client.messages.create(
+        body=message_text,
+        from_=f"whatsapp:{STATIC_WHATSAPP_FROM}",
+        to=f"whatsapp:{phone}"
+    )
+    return message.sid
+
 @frappe.whitelist(allow_guest=True)
 def handle_whatsapp_webhook():
     """Handle incoming WhatsApp responses"""
@@ -6,6 +6,11 @@ import hashlib
 import time
 from twilio.rest import Client
 from datetime import datetime, timedelta
+from twilio_integration.twilio_integration.phone_numbers import normalize_number
+from twilio_integration.twilio_integration.suppression import is_suppressed, process_inbound_keyword
+from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import get_status_callback_url
+from twilio_integration.twilio_integration import outbound
+from twilio_integration.twilio_integration import approval_digest
 
 # ======================== CHATBOT CODE (UNCHANGED FROM ORIGINAL) ========================
 # Configuration
@@ -26,6 +31,10 @@ def handle_whatsapp_chatbot():
         if not message_body or not from_number:
             return "OK"
         
+        # STOP and similar opt the sender out, nothing is sent to them afterwards
+        if process_inbound_keyword(frappe.form_dict.get('From', '').replace('whatsapp:', ''), message_body):
+            return "OK"
+        
         # Handle reset commands
         if message_body.lower() in ['reset', 'restart', 'cancel', '0', 'start']:
             reset_and_start(from_number)
@@ -56,6 +65,11 @@ def is_workflow_action_message(phone_number, message_body):
         
         frappe.log_error(f"Found user {user} for {phone_number}", "User Found Debug")
         
+        # Replies to an approval digest, e.g. "2.1"
+        digest_reply = approval_digest.parse_digest_reply(message_body)
+        if digest_reply and approval_digest.get_digest_item(user, digest_reply[0]):
+            return True
+        
         # Check if user has pending workflow documents
         pending_docs = get_pending_documents_for_user_workflow(user)
         if not pending_docs:
@@ -100,6 +114,12 @@ def process_workflow_action_via_chatbot(phone_number, message_body):
             send_workflow_status_via_chatbot(phone_number, user)
             return
         
+        # Handle digest replies
+        digest_reply = approval_digest.parse_digest_reply(message_body)
+        if digest_reply:
+            execute_digest_action_via_chatbot(phone_number, user, *digest_reply)
+            return
+        
         # Handle numbered actions
         if message_body.isdigit():
             action_number = int(message_body)
@@ -197,7 +217,40 @@ def execute_workflow_action_via_chatbot(phone_number, user, action_number):
             return
         
         selected_action = actions[action_number - 1]
+        perform_workflow_action(phone_number, user, latest_doc, selected_action)
+        
+    except Exception as e:
+        frappe.log_error(f"Execute workflow action error: {str(e)}", "Execute Action Error")
+        send_message(phone_number, "Error executing action. Please try again.")
+
+def execute_digest_action_via_chatbot(phone_number, user, item_number, action_number):
+    """Execute an action numbered in the last approval digest, e.g. "2.1" is the first action of item 2"""
+    try:
+        item = approval_digest.get_digest_item(user, item_number)
+        if not item:
+            send_message(phone_number, "This digest item is no longer available. Reply 'status' to see pending items.")
+            return
+        
+        # The document may have moved on since the digest was sent
+        if frappe.db.get_value(item['doctype'], item['name'], "workflow_state") != item['state']:
+            send_message(phone_number, f"{item['doctype']} {item['name']} is no longer {item['state']}.")
+            return
+        
+        actions = item['actions']
+        if action_number > len(actions) or action_number < 1:
+            actions_text = "\n".join([f"{item_number}.{i+1} - {action['action']}" for i, action in enumerate(actions)])
+            send_message(phone_number, f"Invalid action. Available actions:\n{actions_text}")
+            return
         
+        perform_workflow_action(phone_number, user, item, actions[action_number - 1])
+        
+    except Exception as e:
+        frappe.log_error(f"Execute digest action error: {str(e)}", "Execute Action Error")
+        send_message(phone_number, "Error executing action. Please try again.")
+
+def perform_workflow_action(phone_number, user, doc_info, selected_action):
+    """Apply a workflow action chosen over WhatsApp and confirm it to the approver"""
+    try:
         # Check permissions
         user_roles = frappe.get_roles(user)
         if selected_action['allowed_role'] not in user_roles:
@@ -205,7 +258,7 @@ def execute_workflow_action_via_chatbot(phone_number, user, action_number):
             return
         
         # Execute the action
-        doc = frappe.get_doc(latest_doc['doctype'], latest_doc['name'])
+        doc = frappe.get_doc(doc_info['doctype'], doc_info['name'])
         
         # FIX: Set user context properly
         frappe.set_user(user)
@@ -601,18 +654,27 @@ Type 0 to start a new order."""
         send_message(phone_number, "Please enter 1 or 2")
 
 # ======================== ORIGINAL CHATBOT UTILITY FUNCTIONS ========================
-def send_message(phone_number, message):
-    """Send WhatsApp message"""
+def send_message(phone_number, message, source=None):
+    """Send WhatsApp message, `source` lets it be combined with others sent to the number"""
     try:
-        if not phone_number.startswith('+'):
-            phone_number = '+' + str(phone_number)
-        
+        e164_number = normalize_number(phone_number)
+        if not e164_number:
+            frappe.log_error(f"Invalid WhatsApp number {phone_number}", "Message Error")
+            return False
+        if is_suppressed(e164_number):
+            return False
+        phone_number = e164_number
+
+        if source and outbound.queue_outbound_message(phone_number, message, source):
+            return True
+
         client = Client(STATIC_TWILIO_SID, STATIC_TWILIO_TOKEN)
         
         response = client.messages.create(
             body=message,
             from_=f"whatsapp:{STATIC_WHATSAPP_FROM}",
-            to=f"whatsapp:{phone_number}"
+            to=f"whatsapp:{phone_number}",
+            status_callback=get_status_callback_url()
         )
         
         frappe.log_error(f"Message sent to {phone_number}", "Message Success")
@@ -890,6 +952,10 @@ def send_whatsapp_workflow_notifications(doc, method):
             frappe.logger().info(f"No workflow config found for {doc.doctype} - skipping WhatsApp notification")
             return
         
+        # Approvers get the document in their next scheduled digest instead
+        if workflow_config.get('digest_mode'):
+            return
+        
         # Check if current state requires notification
         if not should_send_notification(doc, workflow_config):
             frappe.logger().info(f"No notification needed for {doc.doctype} {doc.name}")
@@ -912,7 +978,7 @@ def send_whatsapp_workflow_notifications(doc, method):
         sent_count = 0
         failed_count = 0
         for approver in approvers:
-            if send_message(approver['mobile'], message):
+            if send_message(approver['mobile'], message, source=outbound.WORKFLOW_NOTIFICATION):
                 sent_count += 1
             else:
                 failed_count += 1
@@ -950,7 +1016,7 @@ def send_workflow_confirmation(doc, method):
         
         # Send confirmation using chatbot's messaging system
         for approver in approvers:
-            send_message(approver['mobile'], message)
+            send_message(approver['mobile'], message, source=outbound.WORKFLOW_CONFIRMATION)
         
     except Exception as e:
         frappe.logger().error(f"Workflow confirmation failed: {str(e)}")
@@ -959,10 +1025,15 @@ def send_workflow_confirmation(doc, method):
 def get_workflow_config(doctype):
     """Check if WhatsApp workflow is enabled for this doctype - CORRECTED"""
     try:
+        fields = ["name", "notification_states", "confirmation_states", "message_template", "include_amount_field", "amount_field"]
+        # Digest fields are only there once the patch added them to the site's doctype
+        if approval_digest.has_digest_fields():
+            fields.append("digest_mode")
+        
         config = frappe.get_value(
             "WhatsApp Workflow Configuration",
             {"document_type": doctype, "enabled": 1},  # Fixed: use 'document_type' instead of 'doctype'
-            ["name", "notification_states", "confirmation_states", "message_template", "include_amount_field", "amount_field"]
+            fields
         )
         
         if config:
@@ -972,7 +1043,8 @@ def get_workflow_config(doctype):
                 "confirmation_states": (config[2] or "").split('\n'),
                 "message_template": config[3],
                 "include_amount_field": config[4],
-                "amount_field": config[5]
+                "amount_field": config[5],
+                "digest_mode": config[6] if len(config) > 6 else 0
             }
             return result
         return None
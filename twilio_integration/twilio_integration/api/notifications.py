@@ -1,5 +1,15 @@
 import frappe
+from frappe.desk.doctype.notification_log.notification_log import set_notifications_as_unseen
 from twilio_integration.twilio_integration.api.whatsapp_documents import WhatsAppNotificationChannel
+from twilio_integration.twilio_integration.phone_numbers import get_default_country_code, normalize_number
+
+NOTIFICATION_LOG_FIELDS = (
+    "name", "creation", "modified", "owner", "modified_by", "docstatus",
+    "subject", "email_content", "for_user", "from_user", "type", "document_type", "document_name", "read"
+)
+# Rows per INSERT statement
+NOTIFICATION_LOG_CHUNK_SIZE = 500
+USERS_BY_NUMBER_CACHE_KEY = "whatsapp_notification_users_by_number"
 
 def get_notification_config():
     """Configure WhatsApp as a notification channel"""
@@ -20,20 +30,72 @@ def send_whatsapp_notification(recipients, subject, message, reference_doctype=N
         results = channel.send(recipients, subject, message)
         
         # Log notification
-        for result in results:
-            frappe.get_doc({
-                "doctype": "Notification Log",
-                "subject": subject,
-                "email_content": message,
-                "for_user": result["recipient"],
-                "type": "WhatsApp",
-                "document_type": reference_doctype,
-                "document_name": reference_name,
-                "status": "Sent" if result["success"] else "Error"
-            }).insert(ignore_permissions=True)
+        log_notifications(results, subject, message, reference_doctype, reference_name)
         
         return results
         
     except Exception as e:
         frappe.log_error(f"WhatsApp notification failed: {str(e)}")
-        return []
\ No newline at end of file
+        return []
+
+def log_notifications(results, subject, message, reference_doctype=None, reference_name=None):
+    """Write a Notification Log per send result with one INSERT per chunk, skipping per-row ORM hooks.
+    Recipients are phone numbers, logs are only written for numbers that belong to a user.
+    The realtime fan-out those hooks would do runs once per user after the write.
+    """
+    if not results:
+        return
+
+    users = get_users_by_number([result["recipient"] for result in results])
+    results = [result for result in results if users.get(result["recipient"])]
+    if not results:
+        return
+
+    now = frappe.utils.now()
+    user = frappe.session.user
+    rows = [
+        (
+            frappe.generate_hash(length=10), now, now, user, user, 0,
+            subject, message, users[result["recipient"]], user, "Alert", reference_doctype, reference_name, 0
+        )
+        for result in results
+    ]
+
+    for i in range(0, len(rows), NOTIFICATION_LOG_CHUNK_SIZE):
+        frappe.db.bulk_insert("Notification Log", NOTIFICATION_LOG_FIELDS, rows[i:i + NOTIFICATION_LOG_CHUNK_SIZE])
+
+    for for_user in {users[result["recipient"]] for result in results}:
+        set_notifications_as_unseen(for_user)
+        frappe.publish_realtime("notification", after_commit=True, user=for_user)
+
+def get_users_by_number(numbers):
+    """Enabled users the numbers belong to, by number as given.
+    >>> get_users_by_number(['0770 787451', '+256700000000'])
+    ... {'0770 787451': 'jane@example.com'}
+    """
+    users = frappe.cache().get_value(USERS_BY_NUMBER_CACHE_KEY, generator=_get_users_by_number)
+    if not users:
+        return {}
+
+    country_code = get_default_country_code()
+    return {number: users[e164] for number, e164 in
+        ((number, normalize_number(number, country_code)) for number in set(numbers)) if e164 in users}
+
+def _get_users_by_number():
+    """E.164 numbers of enabled users, from the User's mobile and phone and the linked Employee's cell number.
+    """
+    country_code = get_default_country_code()
+    users = {}
+    for row in frappe.db.sql("""SELECT u.name AS user, u.mobile_no, u.phone, e.cell_number
+        FROM `tabUser` u
+        LEFT JOIN `tabEmployee` e ON e.user_id = u.name
+        WHERE u.enabled = 1 AND (IFNULL(u.mobile_no, '') != '' OR IFNULL(u.phone, '') != ''
+            OR IFNULL(e.cell_number, '') != '')""", as_dict=True):
+        for number in (row.mobile_no, row.phone, row.cell_number):
+            e164 = number and normalize_number(number, country_code)
+            if e164:
+                users.setdefault(e164, row.user)
+    return users
+
+def clear_users_by_number(doc=None, method=None):
+    frappe.cache().delete_value(USERS_BY_NUMBER_CACHE_KEY)
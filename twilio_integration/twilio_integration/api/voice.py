@@ -0,0 +1,163 @@
+from werkzeug.wrappers import Response
+
+import frappe
+from frappe import _
+from ..twilio_handler import Twilio, IncomingCall, TwilioCallDetails, get_voice_access_token
+from ..presence import mark_online, mark_offline
+from ..call_log import queue_call_event
+from ..caller_lookup import get_caller_summary
+from ..call_distribution import mark_call_answered, mark_call_completed
+from ..call_queue import remove_from_queue, dispatch_queued_call, get_queue_metrics
+from .. import twiml
+
+@frappe.whitelist()
+def get_twilio_phone_numbers():
+	twilio = Twilio.connect()
+	return (twilio and twilio.get_phone_numbers()) or []
+
+@frappe.whitelist()
+def generate_access_token():
+	"""Returns access token that is required to authenticate Twilio Client SDK.
+	"""
+	from_number = frappe.db.get_value('Voice Call Settings', frappe.session.user, 'twilio_number')
+	if not from_number:
+		return {
+			"ok": False,
+			"error": "caller_phone_identity_missing",
+			"detail": "Phone number is not mapped to the caller"
+		}
+
+	return get_voice_access_token(frappe.session.user, from_number) or {}
+
+@frappe.whitelist()
+def update_agent_presence(status='online', tab=None):
+	"""Heartbeat sent by each browser tab's softphone while its `Twilio.Device` is ready.
+	"""
+	if status == 'offline':
+		mark_offline(frappe.session.user, tab)
+	else:
+		mark_online(frappe.session.user, tab)
+		dispatch_queued_call(frappe.session.user)
+
+@frappe.whitelist(allow_guest=True)
+def voice(**kwargs):
+	"""This is a webhook called by twilio to get instructions when the voice call request comes to twilio server.
+	"""
+	def _get_caller_number(caller):
+		identity = caller.replace('client:', '').strip()
+		user = Twilio.emailid_from_identity(identity)
+		return frappe.db.get_value('Voice Call Settings', user, 'twilio_number')
+
+	args = frappe._dict(kwargs)
+	twilio = Twilio.connect()
+	if not twilio:
+		return
+
+	assert args.AccountSid == twilio.account_sid
+	assert args.ApplicationSid == twilio.application_sid
+
+	# Generate TwiML instructions to make a call
+	from_number = _get_caller_number(args.Caller)
+	resp = twilio.generate_twilio_dial_response(from_number, args.To)
+
+	call_details = TwilioCallDetails(args, call_from=from_number)
+	create_call_log(call_details)
+	return Response(resp, mimetype='text/xml')
+
+@frappe.whitelist(allow_guest=True)
+def twilio_incoming_call_handler(**kwargs):
+	args = frappe._dict(kwargs)
+	call_details = TwilioCallDetails(args)
+	create_call_log(call_details)
+
+	resp = IncomingCall(args.From, args.To, call_sid=args.CallSid).process()
+	return Response(resp, mimetype='text/xml')
+
+@frappe.whitelist(allow_guest=True)
+def dequeued_call_handler(**kwargs):
+	"""This is a webhook called by twilio when a queued call is redirected to a free agent,
+	and as the <Dial> action once the agents dialed for a call hang up or don't answer.
+	"""
+	args = frappe._dict(kwargs)
+	incoming_call = IncomingCall(args.From, args.To, call_sid=args.CallSid)
+
+	if args.DialCallStatus in ('completed', 'answered'):
+		resp = twiml.EMPTY_RESPONSE
+	elif args.DialCallStatus == 'canceled':
+		# The caller hung up while agents were ringing.
+		remove_from_queue(args.CallSid, args.To, 'hangup')
+		resp = twiml.EMPTY_RESPONSE
+	elif args.DialCallStatus:
+		resp = incoming_call.requeue()
+	else:
+		resp = incoming_call.process()
+	return Response(resp, mimetype='text/xml')
+
+@frappe.whitelist(allow_guest=True)
+def call_queue_hold(**kwargs):
+	"""This is a webhook called by twilio to get the hold music of queued callers.
+	"""
+	hold_music_url = frappe.get_cached_doc('Twilio Settings').hold_music_url
+	return Response(twiml.play(hold_music_url), mimetype='text/xml')
+
+@frappe.whitelist(allow_guest=True)
+def call_queue_left(**kwargs):
+	"""This is a webhook called by twilio when a caller leaves the queue.
+	"""
+	args = frappe._dict(kwargs)
+	remove_from_queue(args.CallSid, args.To, args.QueueResult)
+	return Response(twiml.EMPTY_RESPONSE, mimetype='text/xml')
+
+@frappe.whitelist()
+def get_call_queue_metrics(twilio_number=None):
+	"""Queue depth and wait times of a Twilio number, the user's own number by default.
+	"""
+	twilio_number = twilio_number or frappe.db.get_value('Voice Call Settings', frappe.session.user, 'twilio_number')
+	if not twilio_number:
+		return {}
+	return get_queue_metrics(twilio_number)
+
+@frappe.whitelist()
+def create_call_log(call_details: TwilioCallDetails):
+	"""Queue the call for logging, the `Call Log` row is written in the background.
+	"""
+	values = call_details.to_dict()
+	queue_call_event(values.pop('id'), values)
+
+@frappe.whitelist()
+def update_call_log(call_sid, status=None):
+	"""Update call log status.
+	Duration is filled in by the scheduled reconciliation against Twilio's call list.
+	"""
+	if status:
+		queue_call_event(call_sid, {'status': status})
+
+@frappe.whitelist(allow_guest=True)
+def update_recording_info(**kwargs):
+	try:
+		args = frappe._dict(kwargs)
+		queue_call_event(args.CallSid, {'recording_url': args.RecordingUrl})
+	except:
+		frappe.log_error(title=_("Failed to capture Twilio recording"))
+
+@frappe.whitelist(allow_guest=True)
+def agent_call_status(**kwargs):
+	"""This is a webhook called by twilio when an agent's leg of an incoming call is answered or completed.
+	"""
+	args = frappe._dict(kwargs)
+	if not args.agent:
+		return
+
+	if args.CallStatus == 'in-progress':
+		mark_call_answered(args.agent)
+		if args.ParentCallSid and args.twilio_number:
+			remove_from_queue(args.ParentCallSid, args.twilio_number, 'bridged')
+	elif args.CallStatus in ('completed', 'busy', 'no-answer', 'failed', 'canceled'):
+		mark_call_completed(args.agent)
+		dispatch_queued_call(args.agent)
+
+@frappe.whitelist()
+def get_contact_details(phone):
+	"""Get information about existing contact in the system.
+	"""
+	return get_caller_summary(phone)
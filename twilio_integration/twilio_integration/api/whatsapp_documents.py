@@ -5,6 +5,8 @@ import os
 import base64
 from twilio.rest import Client
 from twilio_integration.twilio_integration.doctype.twilio_settings.twilio_settings import get_twilio_credentials
+from twilio_integration.twilio_integration.media import stage_media, purge_expired_media
+from twilio_integration.twilio_integration.pdf_optimizer import is_optimization_enabled, optimize_pdf
 
 @frappe.whitelist()
 def send_document_via_whatsapp(reference_doctype, reference_name, recipients, message=None, print_format=None):
@@ -20,31 +22,45 @@ def send_document_via_whatsapp(reference_doctype, reference_name, recipients, me
         }).insert()
         
         # Generate PDF
-        pdf_file = generate_pdf_for_document(reference_doctype, reference_name, print_format)
-        doc_share.db_set('pdf_file', pdf_file)
+        pdf_content = generate_pdf_for_document(reference_doctype, reference_name, print_format)
         
-        # Send to all recipients
+        # Shrink the PDF before Twilio and every recipient download it
+        if is_optimization_enabled():
+            pdf_content, stats = optimize_pdf(pdf_content)
+            doc_share.db_set({
+                'original_pdf_size': stats['original_size'],
+                'optimized_pdf_size': stats['optimized_size']
+            })
+        
+        # Staged once and purged when its signed URL expires, one URL serves every recipient
+        media_url = stage_media(pdf_content, 'pdf')
+        doc_share.db_set('pdf_file', media_url)
+        
+        # Send to all recipients, collecting outcomes to write back in one pass
+        outcomes = {}
         success_count = 0
         for recipient in doc_share.recipients:
-            result = send_pdf_to_recipient(pdf_file, recipient, message, doc_share.name)
+            result = send_pdf_to_recipient(media_url, recipient, message, doc_share.name)
             if result['success']:
                 success_count += 1
-                recipient.db_set('delivery_status', 'Sent')
-                recipient.db_set('message_id', result['message_id'])
-                recipient.db_set('sent_on', frappe.utils.now())
+                outcomes[recipient.name] = {
+                    'delivery_status': 'Sent',
+                    'message_id': result['message_id'],
+                    'sent_on': frappe.utils.now()
+                }
             else:
-                recipient.db_set('delivery_status', 'Failed')
-                recipient.db_set('error_message', result['error'])
+                outcomes[recipient.name] = {
+                    'delivery_status': 'Failed',
+                    'error_message': result['error']
+                }
         
-        # Update overall status
-        if success_count == len(doc_share.recipients):
-            doc_share.db_set('status', 'Sent')
-        elif success_count > 0:
-            doc_share.db_set('status', 'Partially Sent')
-        else:
-            doc_share.db_set('status', 'Failed')
+        update_recipient_outcomes(outcomes)
         
-        doc_share.db_set('sent_on', frappe.utils.now())
+        # Update overall status
+        doc_share.db_set({
+            'status': get_share_status(success_count, len(doc_share.recipients)),
+            'sent_on': frappe.utils.now()
+        })
         
         return {
             "success": True,
@@ -56,8 +72,47 @@ def send_document_via_whatsapp(reference_doctype, reference_name, recipients, me
         frappe.log_error(f"Failed to send document via WhatsApp: {str(e)}")
         return {"success": False, "error": str(e)}
 
+RECIPIENT_OUTCOME_FIELDS = ('delivery_status', 'message_id', 'sent_on', 'error_message')
+
+def update_recipient_outcomes(outcomes):
+    """Write send outcomes of all recipients back with a single UPDATE.
+
+    `outcomes` maps recipient row name to the fields that changed for it.
+    """
+    if not outcomes:
+        return
+    
+    names = list(outcomes)
+    values = {'names': tuple(names), 'modified': frappe.utils.now()}
+    assignments = []
+    
+    for field in RECIPIENT_OUTCOME_FIELDS:
+        cases = []
+        for i, name in enumerate(names):
+            if field in outcomes[name]:
+                cases.append(f"WHEN %(name_{i})s THEN %({field}_{i})s")
+                values[f"name_{i}"] = name
+                values[f"{field}_{i}"] = outcomes[name][field]
+        
+        if cases:
+            assignments.append(f"`{field}` = CASE `name` {' '.join(cases)} ELSE `{field}` END")
+    
+    frappe.db.sql(f"""
+        UPDATE `tabWhatsApp Document Recipient`
+        SET {', '.join(assignments)}, `modified` = %(modified)s
+        WHERE `name` IN %(names)s
+    """, values)
+
+def get_share_status(success_count, total):
+    """Overall share status from the number of successful sends"""
+    if success_count == total:
+        return 'Sent'
+    elif success_count > 0:
+        return 'Partially Sent'
+    return 'Failed'
+
 def generate_pdf_for_document(doctype, name, print_format=None):
-    """Generate PDF for the document"""
+    """Generate PDF for the document and return its content"""
     try:
         from frappe.utils.pdf import get_pdf
         
@@ -75,46 +130,18 @@ def generate_pdf_for_document(doctype, name, print_format=None):
         html = frappe.get_print(doctype, name, print_format)
         
         # Generate PDF
-        pdf_content = get_pdf(html)
-        
-        # Save to file
-        file_name = f"{doctype}_{name}_{frappe.utils.now()}.pdf".replace(" ", "_").replace(":", "-")
-        file_path = frappe.utils.get_files_path(file_name)
-        
-        with open(file_path, 'wb') as f:
-            f.write(pdf_content)
-        
-        # Create File document
-        file_doc = frappe.get_doc({
-            "doctype": "File",
-            "file_name": file_name,
-            "file_url": f"/files/{file_name}",
-            "is_private": 1
-        }).insert()
-        
-        return file_doc.file_url
+        return get_pdf(html)
         
     except Exception as e:
         frappe.log_error(f"PDF generation failed: {str(e)}")
         raise
 
-def send_pdf_to_recipient(pdf_file, recipient, message, doc_share_name):
+def send_pdf_to_recipient(media_url, recipient, message, doc_share_name):
     """Send PDF file to a single WhatsApp recipient"""
     try:
         account_sid, auth_token, twilio_number = get_twilio_credentials()
         client = Client(account_sid, auth_token)
         
-        # Get file path
-        file_path = frappe.utils.get_site_path() + pdf_file
-        
-        # Upload media to Twilio (for WhatsApp media messages)
-        with open(file_path, 'rb') as f:
-            pdf_content = f.read()
-            
-        # For WhatsApp, we need to upload the media first
-        # Note: This requires Twilio's media upload endpoint
-        media_url = upload_media_to_twilio(pdf_content, f"{recipient.recipient_name}_document.pdf")
-        
         # Send message with media
         message_text = message or f"📄 Document: {recipient.recipient_name}"
         
@@ -131,33 +158,6 @@ def send_pdf_to_recipient(pdf_file, recipient, message, doc_share_name):
         frappe.log_error(f"Failed to send PDF to {recipient.whatsapp_number}: {str(e)}")
         return {"success": False, "error": str(e)}
 
-def upload_media_to_twilio(file_content, filename):
-    """Upload media file to Twilio for WhatsApp"""
-    try:
-        # This is a simplified version - in practice, you'd need to:
-        # 1. Upload to a publicly accessible URL (AWS S3, etc.)
-        # 2. Return that URL for Twilio to access
-        # For now, we'll use a placeholder approach
-        
-        # Save to public files temporarily
-        import tempfile
-        import shutil
-        
-        # Create temporary public file
-        temp_filename = f"temp_whatsapp_{frappe.generate_hash()}.pdf"
-        public_file_path = frappe.utils.get_site_path('public', 'files', temp_filename)
-        
-        with open(public_file_path, 'wb') as f:
-            f.write(file_content)
-        
-        # Return public URL
-        site_url = frappe.utils.get_url()
-        return f"{site_url}/files/{temp_filename}"
-        
-    except Exception as e:
-        frappe.log_error(f"Media upload failed: {str(e)}")
-        raise
-
 # WhatsApp Notification Channel Implementation
 class WhatsAppNotificationChannel:
     """WhatsApp notification channel for ERPNext Notification system"""
@@ -314,25 +314,10 @@ def show_whatsapp_dialog(doctype, name):
 # Cleanup function for temporary files
 @frappe.whitelist()
 def cleanup_temp_whatsapp_files():
-    """Clean up temporary WhatsApp media files"""
+    """Clean up expired WhatsApp media files"""
     try:
-        import glob
-        import os
-        from frappe.utils import get_site_path
-        
-        # Clean files older than 24 hours
-        temp_files = glob.glob(get_site_path('public', 'files', 'temp_whatsapp_*.pdf'))
-        current_time = frappe.utils.now_datetime()
-        
-        for file_path in temp_files:
-            try:
-                file_time = frappe.utils.get_datetime(os.path.getmtime(file_path))
-                if (current_time - file_time).total_seconds() > 86400:  # 24 hours
-                    os.remove(file_path)
-            except:
-                pass
-                
-        return {"success": True, "message": "Temporary files cleaned up"}
+        purged = purge_expired_media()
+        return {"success": True, "message": f"{purged} temporary files cleaned up"}
         
     except Exception as e:
         frappe.log_error(f"Cleanup failed: {str(e)}")
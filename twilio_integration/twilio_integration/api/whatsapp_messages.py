@@ -0,0 +1,30 @@
+from werkzeug.wrappers import Response
+
+import frappe
+from twilio.twiml.messaging_response import MessagingResponse
+from ..suppression import process_delivery_error
+from ..doctype.whatsapp_message.whatsapp_message import incoming_message_callback
+
+@frappe.whitelist(allow_guest=True)
+def incoming_whatsapp_message_handler(**kwargs):
+	"""This is a webhook called by Twilio when a WhatsApp message is received.
+	"""
+	args = frappe._dict(kwargs)
+	incoming_message_callback(args)
+	resp = MessagingResponse()
+
+	# Add a message
+	resp.message(frappe.db.get_single_value('Twilio Settings', 'reply_message'))
+	return Response(resp.to_xml(), mimetype='text/xml')
+
+@frappe.whitelist(allow_guest=True)
+def whatsapp_message_status_callback(**kwargs):
+	"""This is a webhook called by Twilio whenever sent WhatsApp message status is changed.
+	"""
+	args = frappe._dict(kwargs)
+	if frappe.db.exists({'doctype': 'WhatsApp Message', 'id': args.MessageSid, 'from_': args.From, 'to': args.To}):
+		message = frappe.get_doc('WhatsApp Message', {'id': args.MessageSid, 'from_': args.From, 'to': args.To})
+		message.update_status(args.MessageStatus.title())
+
+	# Stop spending sends on numbers Twilio can't deliver to.
+	process_delivery_error(args.To, args.ErrorCode, args.MessageSid)
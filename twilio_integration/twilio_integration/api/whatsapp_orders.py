@@ -4,6 +4,8 @@ import json
 import re
 from twilio.rest import Client
 from twilio_integration.twilio_integration.doctype.twilio_settings.twilio_settings import get_twilio_credentials
+from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import get_status_callback_url
+from twilio_integration.twilio_integration.suppression import process_inbound_keyword, is_suppressed
 
 @frappe.whitelist(allow_guest=True)
 def handle_order_webhook():
@@ -14,6 +16,10 @@ def handle_order_webhook():
         message_body = data.get('Body', '').strip().lower()
         from_number = data.get('From', '').replace('whatsapp:', '')
         
+        # STOP and similar opt the customer out, nothing is sent to them afterwards
+        if process_inbound_keyword(from_number, message_body):
+            return "OK"
+        
         # Get or create order session
         session = get_or_create_order_session(from_number)
         
@@ -191,13 +197,17 @@ def handle_default_response(session):
 def send_whatsapp_message(to_number, message):
     """Send WhatsApp message to customer"""
     try:
+        if is_suppressed(to_number):
+            return
+        
         account_sid, auth_token, twilio_number = get_twilio_credentials()
         client = Client(account_sid, auth_token)
         
         client.messages.create(
             body=message,
             from_=f'whatsapp:{twilio_number}',
-            to=f'whatsapp:{to_number}'
+            to=f'whatsapp:{to_number}',
+            status_callback=get_status_callback_url()
         )
         
     except Exception as e:
@@ -0,0 +1,200 @@
+"""Scheduled approval digests for `WhatsApp Workflow Configuration`.
+
+With digest mode on, workflow notifications are not sent per document. Instead,
+every approver is sent one message listing their pending documents at the
+configured interval, with a numbered action per document ("2.1" approves item 2).
+Digests for all approvers are built from one documents query and one approvers
+query, however many approvers and documents there are.
+"""
+import re
+
+import frappe
+from frappe.utils import add_to_date, get_datetime, now_datetime, fmt_money
+
+# Items beyond this are counted in the digest but not listed, keeps the message within WhatsApp's size limit.
+DIGEST_ITEM_LIMIT = 10
+DEFAULT_DIGEST_INTERVAL = 60
+# Items of the last digest sent to a user, replies refer to them by number.
+DIGEST_ITEMS_KEY = 'whatsapp_approval_digest:{}'
+DIGEST_ITEMS_TTL = 24 * 60 * 60
+DIGEST_REPLY = re.compile(r'^\s*(\d+)\.(\d+)\s*$')
+
+
+def has_digest_fields():
+	"""Whether the digest fields were added to the site's `WhatsApp Workflow Configuration`.
+	"""
+	return bool(frappe.db.exists('DocType', 'WhatsApp Workflow Configuration')
+		and frappe.get_meta('WhatsApp Workflow Configuration').has_field('digest_mode'))
+
+def get_due_configs():
+	"""Enabled digest configurations whose interval has passed since their last digest.
+	"""
+	if not has_digest_fields():
+		return []
+
+	now = now_datetime()
+	return [config for config in frappe.get_all('WhatsApp Workflow Configuration',
+			filters={'enabled': 1, 'digest_mode': 1},
+			fields=['name', 'document_type', 'notification_states', 'include_amount_field',
+				'amount_field', 'digest_interval', 'last_digest_sent'])
+		if not config.last_digest_sent
+			or add_to_date(get_datetime(config.last_digest_sent), minutes=config.digest_interval or DEFAULT_DIGEST_INTERVAL) <= now]
+
+def send_approval_digests():
+	"""Runs on schedule, sends every approver of due configurations their digest.
+	"""
+	configs = get_due_configs()
+	if not configs:
+		return
+
+	from twilio_integration.services.whatsapp_order_chatbot import send_message
+
+	for approver in build_digests(configs):
+		if send_message(approver['mobile'], format_digest(approver['items'])):
+			frappe.cache().set_value(DIGEST_ITEMS_KEY.format(approver['user']), approver['items'][:DIGEST_ITEM_LIMIT],
+				expires_in_sec=DIGEST_ITEMS_TTL)
+
+	frappe.db.sql("""UPDATE `tabWhatsApp Workflow Configuration` SET last_digest_sent = %s
+		WHERE name IN %s""", (now_datetime(), tuple(config.name for config in configs)))
+	frappe.db.commit()
+
+def build_digests(configs: list):
+	"""Pending items of every approver of the configurations, most recently modified first.
+	>>> build_digests(configs)
+	... [{'user': 'jane@example.com', 'mobile': '+256770787451', 'items': [
+		{'doctype': 'Sales Order', 'name': 'SO-0001', 'state': 'Pending', 'amount': '$ 120.00',
+			'actions': [{'action': 'Approve', 'next_state': 'Approved', 'allowed_role': 'Sales Manager'}]}
+	]}]
+	"""
+	states = {config.document_type: [state.strip() for state in (config.notification_states or '').split('\n') if state.strip()]
+		for config in configs}
+	transitions = get_transitions(states)
+	documents = get_pending_documents(configs, transitions)
+	if not documents:
+		return []
+
+	roles = {transition.allowed for actions in transitions.values() for transition in actions if transition.allowed}
+	approvers = get_approvers(roles)
+
+	digests = []
+	for user, approver in approvers.items():
+		items = []
+		for document in documents:
+			actions = [{
+				'action': transition.action,
+				'next_state': transition.next_state,
+				'allowed_role': transition.allowed
+			} for transition in transitions[(document.doctype, document.workflow_state)] if transition.allowed in approver['roles']]
+			if actions:
+				items.append({
+					'doctype': document.doctype,
+					'name': document.name,
+					'state': document.workflow_state,
+					'amount': document.amount,
+					'actions': actions
+				})
+
+		if items:
+			digests.append({'user': user, 'mobile': approver['mobile'], 'items': items})
+	return digests
+
+def get_transitions(states: dict):
+	"""Transitions out of the notified states, by (doctype, state) in workflow order.
+	"""
+	workflows = dict(frappe.get_all('Workflow',
+		filters={'document_type': ['in', list(states)], 'is_active': 1},
+		fields=['name', 'document_type'],
+		as_list=True
+	))
+	if not workflows:
+		return {}
+
+	transitions = {(doctype, state): [] for doctype, doctype_states in states.items() for state in doctype_states}
+	for transition in frappe.get_all('Workflow Transition',
+		filters={'parent': ['in', list(workflows)]},
+		fields=['parent', 'state', 'action', 'next_state', 'allowed'],
+		order_by='parent, idx'
+	):
+		key = (workflows[transition.parent], transition.state)
+		if key in transitions:
+			transitions[key].append(transition)
+	return {key: actions for key, actions in transitions.items() if actions}
+
+def get_pending_documents(configs: list, transitions: dict):
+	"""Documents waiting in a notified state, across all configured doctypes in one query.
+	"""
+	selects, values = [], {}
+	for i, config in enumerate(configs):
+		doctype_states = tuple(state for doctype, state in transitions if doctype == config.document_type)
+		if not doctype_states:
+			continue
+
+		meta = frappe.get_meta(config.document_type)
+		# Field names come from configuration, only ever select real columns.
+		amount_field = config.amount_field if config.include_amount_field and meta.has_field(config.amount_field) else None
+		selects.append("""SELECT %(doctype_{i})s AS doctype, name, modified, workflow_state,
+				{amount} AS amount, {currency} AS currency
+			FROM `tab{doctype}` WHERE workflow_state IN %(states_{i})s AND docstatus < 2""".format(
+			i=i,
+			doctype=config.document_type,
+			amount='`{}`'.format(amount_field) if amount_field else 'NULL',
+			currency='currency' if amount_field and meta.has_field('currency') else 'NULL'
+		))
+		values.update({'doctype_{}'.format(i): config.document_type, 'states_{}'.format(i): doctype_states})
+
+	if not selects:
+		return []
+
+	documents = frappe.db.sql('{} ORDER BY modified DESC'.format(' UNION ALL '.join(selects)), values, as_dict=True)
+	default_currency = frappe.defaults.get_global_default('currency')
+	for document in documents:
+		if document.amount is not None:
+			document.amount = fmt_money(document.amount, currency=document.currency or default_currency)
+	return documents
+
+def get_approvers(roles: set):
+	"""Enabled users holding any of the roles, with their roles and WhatsApp number.
+	The number is the Employee's cell number, falling back to the User's mobile.
+	"""
+	if not roles:
+		return {}
+
+	approvers = {}
+	for row in frappe.db.sql("""SELECT hr.role, u.name AS user,
+			COALESCE(NULLIF(e.cell_number, ''), u.mobile_no) AS mobile
+		FROM `tabHas Role` hr
+		INNER JOIN `tabUser` u ON u.name = hr.parent
+		LEFT JOIN `tabEmployee` e ON e.user_id = u.name
+		WHERE hr.parenttype = 'User' AND hr.role IN %s AND u.enabled = 1""", (tuple(roles),), as_dict=True):
+		if row.mobile:
+			approvers.setdefault(row.user, {'mobile': row.mobile, 'roles': set()})['roles'].add(row.role)
+	return approvers
+
+def format_digest(items: list):
+	message = f"📋 *PENDING APPROVALS* ({len(items)})\n\n"
+	for i, item in enumerate(items[:DIGEST_ITEM_LIMIT], 1):
+		message += f"*{i}. {item['doctype']}: {item['name']}*\n"
+		message += f"📊 State: {item['state']}\n"
+		if item['amount']:
+			message += f"💰 Amount: {item['amount']}\n"
+		message += "Reply " + " | ".join(f"{i}.{j} - {action['action']}" for j, action in enumerate(item['actions'], 1))
+		message += "\n\n"
+
+	if len(items) > DIGEST_ITEM_LIMIT:
+		message += f"... and {len(items) - DIGEST_ITEM_LIMIT} more, they are listed in the next digest once these are done.\n\n"
+	return message + "_ERPNext Workflow_"
+
+def parse_digest_reply(message: str):
+	"""Item and action number of a digest reply.
+	>>> parse_digest_reply('2.1')
+	... (2, 1)
+	"""
+	match = DIGEST_REPLY.match(message or '')
+	return (int(match.group(1)), int(match.group(2))) if match else None
+
+def get_digest_item(user: str, item_number: int):
+	"""An item of the last digest sent to the user, by its number in the digest.
+	"""
+	items = frappe.cache().get_value(DIGEST_ITEMS_KEY.format(user)) or []
+	if 1 <= item_number <= len(items):
+		return items[item_number - 1]
@@ -0,0 +1,88 @@
+"""Pick which number owners an incoming call is offered to.
+
+Agent state lives in Redis sorted sets fed by the per-agent call status callbacks,
+so choosing attenders costs one pipelined round trip whatever the strategy.
+"""
+import time
+
+import frappe
+
+ROUND_ROBIN = 'Round Robin'
+LEAST_RECENTLY_ANSWERED = 'Least Recently Answered'
+LONGEST_IDLE = 'Longest Idle'
+
+# Agents on a call, scored by the time they answered it.
+BUSY_AGENTS_KEY = 'twilio_busy_agents'
+# A lost `completed` callback must not keep an agent busy forever.
+BUSY_TIMEOUT = 4 * 60 * 60
+LAST_ANSWERED_KEY = 'twilio_agent_last_answered'
+# Agents scored by the time their last call ended.
+IDLE_SINCE_KEY = 'twilio_agent_idle_since'
+ROUND_ROBIN_KEY = 'twilio_round_robin:{}'
+
+# Twilio allows at most 10 nouns in a single <Dial>.
+SIMULTANEOUS_RING_LIMIT = 10
+
+
+def get_key(key: str):
+	return frappe.cache().make_key(key)
+
+def mark_call_answered(agent: str):
+	now = time.time()
+	pipe = frappe.cache().pipeline()
+	pipe.zadd(get_key(BUSY_AGENTS_KEY), {agent: now})
+	pipe.zadd(get_key(LAST_ANSWERED_KEY), {agent: now})
+	pipe.execute()
+
+def mark_call_completed(agent: str):
+	# Legs that were never answered (another agent picked up) don't reset idle time.
+	if frappe.cache().zrem(get_key(BUSY_AGENTS_KEY), agent):
+		frappe.cache().zadd(get_key(IDLE_SINCE_KEY), {agent: time.time()})
+
+def is_agent_available(agent: str):
+	busy_since = frappe.cache().zscore(get_key(BUSY_AGENTS_KEY), agent)
+	return not (busy_since and busy_since > time.time() - BUSY_TIMEOUT)
+
+def get_agent_scores(agents: list):
+	"""Busy since, last answered and idle since timestamps of each agent.
+	"""
+	pipe = frappe.cache().pipeline()
+	for agent in agents:
+		pipe.zscore(get_key(BUSY_AGENTS_KEY), agent)
+		pipe.zscore(get_key(LAST_ANSWERED_KEY), agent)
+		pipe.zscore(get_key(IDLE_SINCE_KEY), agent)
+	scores = pipe.execute()
+	return {agent: scores[i * 3: i * 3 + 3] for i, agent in enumerate(agents)}
+
+def order_agents(agents: list, strategy: str, twilio_number: str):
+	"""Available agents, most preferred first. Busy agents are left out.
+	>>> order_agents(['a@example.com', 'b@example.com'], 'Longest Idle', '+11234567890')
+	... ['b@example.com', 'a@example.com']
+	"""
+	if not agents:
+		return []
+
+	scores = get_agent_scores(agents)
+	busy_cutoff = time.time() - BUSY_TIMEOUT
+	available = [agent for agent in agents
+		if not (scores[agent][0] and scores[agent][0] > busy_cutoff)]
+	if not available:
+		return []
+
+	if strategy == LEAST_RECENTLY_ANSWERED:
+		return sorted(available, key=lambda agent: scores[agent][1] or 0)
+	if strategy == LONGEST_IDLE:
+		return sorted(available, key=lambda agent: scores[agent][2] or 0)
+
+	# Round robin, agents keep their configured order and the start rotates per call.
+	turn = frappe.cache().incr(get_key(ROUND_ROBIN_KEY.format(twilio_number)))
+	start = turn % len(available)
+	return available[start:] + available[:start]
+
+def get_call_attenders(owners: dict, eligible: list, twilio_number: str):
+	"""Owner details of the agents to ring, a single agent unless simultaneous ring is enabled.
+	"""
+	settings = frappe.get_cached_doc('Twilio Settings')
+	agents = order_agents(eligible, settings.call_distribution_strategy or ROUND_ROBIN, twilio_number)
+	limit = SIMULTANEOUS_RING_LIMIT if settings.simultaneous_ring else 1
+	return [owners[agent] for agent in agents[:limit]]
@@ -0,0 +1,184 @@
+"""Call Log writes, moved off the voice webhook path.
+
+Webhooks append call events to a Redis list and return their TwiML right away.
+A background consumer drains the list and materializes the events into `Call Log`,
+merging every event of a call into its row in the order the events arrived.
+"""
+import json
+from datetime import timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import frappe
+from frappe.utils import now_datetime, get_datetime, get_system_timezone
+from .twilio_handler import Twilio, TwilioCallDetails
+
+CALL_EVENT_QUEUE = 'twilio_call_events'
+CALL_EVENT_BATCH_SIZE = 500
+# Set while a consumer job is queued, so a burst of events enqueues a single job.
+CONSUMER_SCHEDULED_KEY = 'twilio_call_event_consumer_scheduled'
+CONSUMER_LOCK_KEY = 'twilio_call_event_consumer_lock'
+
+OPEN_CALL_STATUSES = ('Initiated', 'Queued', 'Ringing', 'In Progress')
+# Calls closed by the softphone have no duration yet, they are reconciled for this long.
+UNTIMED_CALL_WINDOW = timedelta(days=1)
+# In UTC, the timezone twilio-python sends datetimes in.
+RECONCILE_CURSOR_KEY = 'twilio_call_reconcile_cursor_utc'
+# Re-read a little before the cursor so calls ending while a run was in flight aren't missed.
+RECONCILE_OVERLAP = timedelta(minutes=5)
+RECONCILE_PAGE_SIZE = 1000
+
+
+def queue_call_event(call_sid: str, values: dict):
+	"""Append an event for a call, `values` are `Call Log` fields to set on its row.
+	>>> queue_call_event('CA123', {'status': 'Completed', 'duration': 42})
+	"""
+	if not call_sid:
+		return
+
+	cache = frappe.cache()
+	# RedisWrapper.rpush prefixes the key itself, matching the raw key read in pop_call_events.
+	cache.rpush(CALL_EVENT_QUEUE, json.dumps({'call_sid': call_sid, 'values': values}))
+	schedule_consumer()
+
+def schedule_consumer():
+	cache = frappe.cache()
+	if cache.set(cache.make_key(CONSUMER_SCHEDULED_KEY), 1, nx=True, ex=5 * 60):
+		frappe.enqueue(
+			'twilio_integration.twilio_integration.call_log.consume_call_events',
+			queue='short'
+		)
+
+def consume_call_events():
+	"""Drain queued call events into `Call Log`.
+	Also runs from the scheduler to pick up events whose consumer job was lost.
+	"""
+	cache = frappe.cache()
+	# Cleared before draining, events queued from now on schedule another run.
+	cache.delete(cache.make_key(CONSUMER_SCHEDULED_KEY))
+
+	# A single consumer at a time keeps the events of a call in order. While one is
+	# draining there is nothing to do, events it misses are picked up by the scheduler.
+	lock = cache.lock(cache.make_key(CONSUMER_LOCK_KEY), timeout=10 * 60)
+	if not lock.acquire(blocking=False):
+		return
+
+	try:
+		while True:
+			events = pop_call_events(CALL_EVENT_BATCH_SIZE)
+			if not events:
+				break
+
+			for call_sid, values in merge_call_events(events).items():
+				try:
+					materialize_call_log(call_sid, values)
+				except Exception:
+					frappe.log_error(title='Failed to write Twilio Call Log {}'.format(call_sid))
+			frappe.db.commit()
+	finally:
+		lock.release()
+
+def pop_call_events(count: int):
+	"""Atomically take the oldest `count` events off the queue.
+	"""
+	cache = frappe.cache()
+	key = cache.make_key(CALL_EVENT_QUEUE)
+	pipe = cache.pipeline()
+	pipe.lrange(key, 0, count - 1)
+	pipe.ltrim(key, count, -1)
+	events, _ = pipe.execute()
+	return [json.loads(event) for event in events]
+
+def merge_call_events(events: list):
+	"""Fold events into one set of values per call, later events win.
+	>>> merge_call_events([
+		{'call_sid': 'CA1', 'values': {'status': 'Ringing', 'type': 'Incoming'}},
+		{'call_sid': 'CA1', 'values': {'status': 'Completed'}}
+	])
+	... {'CA1': {'status': 'Completed', 'type': 'Incoming'}}
+	"""
+	merged = {}
+	for event in events:
+		merged.setdefault(event['call_sid'], {}).update(event['values'])
+	return merged
+
+def materialize_call_log(call_sid: str, values: dict):
+	if frappe.db.exists('Call Log', call_sid):
+		call_log = frappe.get_doc('Call Log', call_sid)
+		call_log.update(values)
+	elif values.get('type'):
+		call_log = frappe.get_doc({**values,
+			'doctype': 'Call Log',
+			'id': call_sid,
+			'medium': 'Twilio'
+		})
+	else:
+		# Updates for a call that was never logged, nothing to attach them to.
+		return
+
+	call_log.flags.ignore_permissions = True
+	call_log.save()
+
+def to_utc(value):
+	"""Naive site-local datetime as UTC, twilio-python formats datetimes without converting them.
+	"""
+	return value.replace(tzinfo=ZoneInfo(get_system_timezone())).astimezone(timezone.utc)
+
+def reconcile_open_calls():
+	"""Update status and duration of every open Twilio `Call Log` in bulk.
+	Calls the softphone closed are included until they have a duration.
+
+	Pages through Twilio's Calls list for calls that ended since the previous run
+	instead of fetching calls one by one, then writes all changes in one UPDATE.
+	"""
+	twilio = Twilio.connect()
+	if not twilio:
+		return
+
+	run_started = to_utc(now_datetime())
+	open_calls = frappe.db.sql("""SELECT name, creation FROM `tabCall Log`
+		WHERE medium = 'Twilio' AND (status IN %s OR (IFNULL(duration, 0) = 0 AND creation >= %s))""",
+		(OPEN_CALL_STATUSES, now_datetime() - UNTIMED_CALL_WINDOW), as_dict=True)
+
+	if open_calls:
+		cursor = frappe.db.get_global(RECONCILE_CURSOR_KEY)
+		ended_after = (get_datetime(cursor).replace(tzinfo=timezone.utc) if cursor
+			else to_utc(min(c.creation for c in open_calls))) - RECONCILE_OVERLAP
+		open_call_sids = {c.name for c in open_calls}
+
+		updates = {}
+		for call in twilio.twilio_client.calls.stream(end_time_after=ended_after, page_size=RECONCILE_PAGE_SIZE):
+			if call.sid in open_call_sids:
+				updates[call.sid] = {
+					'status': TwilioCallDetails.get_call_status(call.status),
+					'duration': call.duration
+				}
+		bulk_update_call_logs(updates)
+
+	frappe.db.set_global(RECONCILE_CURSOR_KEY, run_started.strftime('%Y-%m-%d %H:%M:%S'))
+	frappe.db.commit()
+
+def bulk_update_call_logs(updates: dict):
+	"""Set status and duration of many calls with a single UPDATE.
+	>>> bulk_update_call_logs({'CA1': {'status': 'Completed', 'duration': '42'}})
+	"""
+	if not updates:
+		return
+
+	values = {'names': tuple(updates), 'modified': now_datetime()}
+	status_cases, duration_cases = [], []
+	for i, (call_sid, call) in enumerate(updates.items()):
+		values.update({
+			'name_{}'.format(i): call_sid,
+			'status_{}'.format(i): call['status'],
+			'duration_{}'.format(i): call['duration'] or 0
+		})
+		status_cases.append('WHEN %(name_{0})s THEN %(status_{0})s'.format(i))
+		duration_cases.append('WHEN %(name_{0})s THEN %(duration_{0})s'.format(i))
+
+	frappe.db.sql("""
+		UPDATE `tabCall Log`
+		SET `status` = CASE `name` {} END,
+			`duration` = CASE `name` {} END,
+			`modified` = %(modified)s
+		WHERE `name` IN %(names)s
+	""".format(' '.join(status_cases), ' '.join(duration_cases)), values)
@@ -0,0 +1,153 @@
+"""Hold incoming calls in a Twilio queue while every agent of the number is busy.
+
+Waiting calls are tracked per Twilio number in Redis. When an agent frees up or
+comes online, the longest waiting call is moved to the number's offered calls and
+redirected back through call routing, which dials the available agents or puts
+the caller back in the queue, in its original place.
+"""
+import re
+import time
+
+import frappe
+from .utils import get_public_url
+from .call_distribution import get_key, is_agent_available
+
+# Waiting calls of a Twilio number, scored by the time they were queued.
+CALL_QUEUE_KEY = 'twilio_call_queue:{}'
+# Calls taken off the waiting list and offered to an agent, scored by the time they were first queued.
+CALL_OFFERED_KEY = 'twilio_call_offered:{}'
+# Per number counters of calls that left the queue and their total wait.
+CALL_QUEUE_STATS_KEY = 'twilio_call_queue_stats:{}'
+# An agent gets one queued call offered at a time, for as long as it rings.
+AGENT_OFFERED_KEY = 'twilio_agent_offered:{}'
+AGENT_OFFER_TIMEOUT = 60
+# Moves the longest waiting call to the offered set in one step, so that a call is offered to one agent at a time.
+OFFER_CALL_SCRIPT = """
+local call = redis.call('ZPOPMIN', KEYS[1])
+if call[1] then
+	redis.call('ZADD', KEYS[2], call[2], call[1])
+end
+return call[1]
+"""
+
+QUEUE_HOLD_PATH = "/api/method/twilio_integration.twilio_integration.api.voice.call_queue_hold"
+QUEUE_LEFT_PATH = "/api/method/twilio_integration.twilio_integration.api.voice.call_queue_left"
+DEQUEUED_CALL_PATH = "/api/method/twilio_integration.twilio_integration.api.voice.dequeued_call_handler"
+
+
+def is_call_queue_enabled():
+	return bool(frappe.get_cached_doc('Twilio Settings').enable_call_queue)
+
+def get_queue_name(twilio_number: str):
+	"""Twilio queue name of a number.
+	>>> get_queue_name('+1 123-456-7890')
+	... 'twilio-11234567890'
+	"""
+	return 'twilio-' + re.sub(r'\D', '', twilio_number or '')
+
+def add_to_queue(call_sid: str, twilio_number: str):
+	"""Record a call waiting for the number's agents. A call put back in the queue keeps its place.
+	"""
+	offered_key = get_key(CALL_OFFERED_KEY.format(twilio_number))
+	queued_on = frappe.cache().zscore(offered_key, call_sid) or time.time()
+
+	pipe = frappe.cache().pipeline()
+	pipe.zadd(get_key(CALL_QUEUE_KEY.format(twilio_number)), {call_sid: queued_on}, nx=True)
+	pipe.zrem(offered_key, call_sid)
+	pipe.execute()
+
+def remove_from_queue(call_sid: str, twilio_number: str, queue_result: str):
+	"""Take a call off the number's waiting list once it is answered or abandoned.
+	Calls redirected to an agent are kept until the agent answers, they may come back to the queue.
+	"""
+	if queue_result in ('redirected', 'redirected-from-action'):
+		return
+
+	queue_key = get_key(CALL_QUEUE_KEY.format(twilio_number))
+	offered_key = get_key(CALL_OFFERED_KEY.format(twilio_number))
+	pipe = frappe.cache().pipeline()
+	pipe.zscore(queue_key, call_sid)
+	pipe.zscore(offered_key, call_sid)
+	pipe.zrem(queue_key, call_sid)
+	pipe.zrem(offered_key, call_sid)
+	waiting_since, offered_since, removed, removed_offered = pipe.execute()
+	if not (removed or removed_offered):
+		return
+
+	queued_on = waiting_since or offered_since
+
+	stats_key = get_key(CALL_QUEUE_STATS_KEY.format(twilio_number))
+	pipe = frappe.cache().pipeline()
+	pipe.hincrby(stats_key, 'calls', 1)
+	pipe.hincrby(stats_key, 'answered' if queue_result == 'bridged' else 'abandoned', 1)
+	pipe.hincrby(stats_key, 'total_wait', int(time.time() - queued_on))
+	pipe.execute()
+
+def dispatch_queued_call(agent: str):
+	"""Offer the longest waiting call of the agent's number to the agent, if they are free.
+	"""
+	twilio_number = frappe.get_cached_value('Voice Call Settings', agent, 'twilio_number')
+	if not twilio_number:
+		return
+
+	cache = frappe.cache()
+	queue_key = get_key(CALL_QUEUE_KEY.format(twilio_number))
+	if not cache.zcard(queue_key) or not is_agent_available(agent):
+		return
+
+	if not cache.set(get_key(AGENT_OFFERED_KEY.format(agent)), 1, nx=True, ex=AGENT_OFFER_TIMEOUT):
+		return
+
+	call_sid = cache.eval(OFFER_CALL_SCRIPT, 2, queue_key, get_key(CALL_OFFERED_KEY.format(twilio_number)))
+	if call_sid:
+		frappe.enqueue(
+			'twilio_integration.twilio_integration.call_queue.redirect_queued_call',
+			queue='short',
+			call_sid=frappe.safe_decode(call_sid),
+			twilio_number=twilio_number
+		)
+	else:
+		# Another agent took the last waiting call.
+		cache.delete(get_key(AGENT_OFFERED_KEY.format(agent)))
+
+def redirect_queued_call(call_sid: str, twilio_number: str):
+	"""Take the call out of the Twilio queue and route it to the agents again.
+	"""
+	from .twilio_handler import Twilio
+
+	twilio = Twilio.connect()
+	if not twilio:
+		return
+
+	try:
+		twilio.twilio_client.calls(call_sid).update(url=get_public_url(DEQUEUED_CALL_PATH), method='POST')
+	except Exception:
+		# Mostly calls that ended without Twilio reporting it, they would block the queue.
+		remove_from_queue(call_sid, twilio_number, 'error')
+		frappe.log_error(title='Failed to dequeue Twilio call {}'.format(call_sid))
+
+def get_queue_metrics(twilio_number: str):
+	"""Queue depth and wait times of a number, in seconds.
+	>>> get_queue_metrics('+11234567890')
+	... {'queue': 'twilio-11234567890', 'waiting': 3, 'longest_wait': 95, 'calls': 40,
+		'answered': 36, 'abandoned': 4, 'average_wait': 21}
+	"""
+	cache = frappe.cache()
+	queue_key = get_key(CALL_QUEUE_KEY.format(twilio_number))
+	pipe = cache.pipeline()
+	pipe.zcard(queue_key)
+	pipe.zrange(queue_key, 0, 0, withscores=True)
+	pipe.hgetall(get_key(CALL_QUEUE_STATS_KEY.format(twilio_number)))
+	waiting, oldest, stats = pipe.execute()
+
+	stats = {frappe.safe_decode(k): int(v) for k, v in stats.items()}
+	calls = stats.get('calls', 0)
+	return {
+		'queue': get_queue_name(twilio_number),
+		'waiting': waiting,
+		'longest_wait': int(time.time() - oldest[0][1]) if oldest else 0,
+		'calls': calls,
+		'answered': stats.get('answered', 0),
+		'abandoned': stats.get('abandoned', 0),
+		'average_wait': int(stats.get('total_wait', 0) / calls) if calls else 0
+	}
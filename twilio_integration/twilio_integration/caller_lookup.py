@@ -0,0 +1,91 @@
+"""Caller details for the incoming call popup.
+
+Summaries are keyed by the caller's number and warmed while the call is being
+routed, so the popup is served from cache by the time the browser asks for it.
+"""
+import frappe
+
+CALLER_SUMMARY_CACHE_KEY = 'twilio_caller_summary:{}'
+CALLER_SUMMARY_TTL = 24 * 60 * 60
+# Unknown callers are remembered for a shorter time, they may be added as contacts.
+UNKNOWN_CALLER_TTL = 10 * 60
+
+
+def get_phone_variants(phone: str):
+	"""Spellings a number may be stored with in `Contact Phone`.
+	>>> get_phone_variants('+256 770-787451')
+	... ('+256 770-787451', '+256770787451', '256770787451')
+	"""
+	phone = phone.strip()
+	digits = ''.join(c for c in phone if c.isdigit())
+	return tuple(dict.fromkeys([phone, '+' + digits, digits]))
+
+def get_cache_key(phone: str):
+	return CALLER_SUMMARY_CACHE_KEY.format(get_phone_variants(phone)[1])
+
+def get_caller_summary(phone: str):
+	"""Name, email, customer and last interaction of the contact owning the number.
+	>>> get_caller_summary('+256770787451')
+	... {'first_name': 'Jane', 'email_id': 'jane@example.com', 'phone_number': '+256770787451',
+		'customer': 'Jane Stores', 'last_interaction': '2026-10-18 09:12:03'}
+	"""
+	if not phone:
+		return
+
+	key = get_cache_key(phone)
+	summary = frappe.cache().get_value(key)
+	if summary is None:
+		summary = build_caller_summary(phone)
+		frappe.cache().set_value(key, summary,
+			expires_in_sec=CALLER_SUMMARY_TTL if summary else UNKNOWN_CALLER_TTL)
+	return summary or None
+
+def warm_caller_summary(phone: str):
+	"""Load the caller summary into cache ahead of the popup, in the background.
+	"""
+	if phone and frappe.cache().get_value(get_cache_key(phone)) is None:
+		frappe.enqueue(
+			'twilio_integration.twilio_integration.caller_lookup.get_caller_summary',
+			queue='short',
+			phone=phone
+		)
+
+def build_caller_summary(phone: str):
+	rows = frappe.db.sql("""
+		SELECT
+			c.name, c.first_name, c.email_id, cp.phone AS phone_number,
+			(SELECT dl.link_name FROM `tabDynamic Link` dl
+				WHERE dl.parenttype = 'Contact' AND dl.parent = c.name AND dl.link_doctype = 'Customer'
+				LIMIT 1) AS customer,
+			(SELECT MAX(com.communication_date) FROM `tabCommunication Link` cl
+				INNER JOIN `tabCommunication` com ON com.name = cl.parent
+				WHERE cl.link_doctype = 'Contact' AND cl.link_name = c.name) AS last_interaction
+		FROM `tabContact Phone` cp
+		INNER JOIN `tabContact` c ON c.name = cp.parent
+		WHERE cp.parenttype = 'Contact' AND cp.phone IN %(phones)s
+		ORDER BY c.is_primary_contact DESC, c.modified DESC
+		LIMIT 1
+	""", {'phones': get_phone_variants(phone)}, as_dict=True)
+
+	if not rows:
+		return {}
+
+	contact = rows[0]
+	summary = {
+		'first_name': (contact.first_name or contact.name).title(),
+		'email_id': contact.email_id,
+		'phone_number': contact.phone_number,
+		'customer': contact.customer,
+		'last_interaction': contact.last_interaction and str(contact.last_interaction)
+	}
+	return {key: value for key, value in summary.items() if value}
+
+def clear_caller_summary(doc, method=None):
+	"""Drop cached summaries of a contact's numbers when the contact changes,
+	including numbers removed or edited in this save.
+	"""
+	before_save = doc.get_doc_before_save()
+	phones = {row.phone for row in (doc.get('phone_nos') or []) + ((before_save and before_save.get('phone_nos')) or [])}
+	for phone in phones:
+		if phone:
+			frappe.cache().delete_value(get_cache_key(phone))
@@ -0,0 +1,110 @@
+"""Delivery counters of WhatsApp campaigns.
+
+Status callbacks move a message from one counter to the next in a Redis hash per
+campaign, so reading a campaign's counters is a single HGETALL. Campaigns with
+changed counters are rolled up into their `WhatsApp Campaign` fields on schedule.
+"""
+import frappe
+
+COUNTERS = ('queued', 'sent', 'delivered', 'read', 'failed')
+STATUS_COUNTERS = {
+	'Accepted': 'queued',
+	'Queued': 'queued',
+	'Sending': 'queued',
+	'Sent': 'sent',
+	'Delivered': 'delivered',
+	'Read': 'read',
+	'Failed': 'failed',
+	'Undelivered': 'failed',
+	'Error': 'failed'
+}
+# Callbacks may arrive out of order, a message only ever moves forward.
+COUNTER_RANK = {counter: rank for rank, counter in enumerate(COUNTERS)}
+
+CAMPAIGN_COUNTERS_KEY = 'whatsapp_campaign_counters:{}'
+# Marks a hash that holds every message of the campaign, not only changes since a cache flush.
+LOADED_FIELD = '_loaded'
+DIRTY_CAMPAIGNS_KEY = 'whatsapp_campaign_counters_dirty'
+
+
+def get_key(key: str):
+	return frappe.cache().make_key(key)
+
+def is_status_forward(old_status: str, new_status: str):
+	"""Whether a message may move from `old_status` to `new_status`.
+	>>> is_status_forward('Read', 'Delivered')
+	... False
+	"""
+	old, new = STATUS_COUNTERS.get(old_status), STATUS_COUNTERS.get(new_status)
+	if not (old and new):
+		return True
+	return COUNTER_RANK[new] > COUNTER_RANK[old]
+
+def record_status_change(reference_doctype: str, campaign: str, old_status: str, new_status: str):
+	if reference_doctype != 'WhatsApp Campaign' or not campaign:
+		return
+
+	old, new = STATUS_COUNTERS.get(old_status), STATUS_COUNTERS.get(new_status)
+	if not new or old == new:
+		return
+
+	key = get_key(CAMPAIGN_COUNTERS_KEY.format(campaign))
+	pipe = frappe.cache().pipeline()
+	if old:
+		pipe.hincrby(key, old, -1)
+	pipe.hincrby(key, new, 1)
+	pipe.sadd(get_key(DIRTY_CAMPAIGNS_KEY), campaign)
+	pipe.execute()
+
+def get_campaign_counters(campaign: str):
+	"""Number of the campaign's messages in each delivery state.
+	>>> get_campaign_counters('WA-CAMP-0001')
+	... {'queued': 0, 'sent': 12, 'delivered': 840, 'read': 3120, 'failed': 28}
+	"""
+	# Counters are raw integers written by HINCRBY, read them past RedisWrapper's prefixing and unpickling.
+	pipe = frappe.cache().pipeline()
+	pipe.hgetall(get_key(CAMPAIGN_COUNTERS_KEY.format(campaign)))
+	counters = {frappe.safe_decode(k): int(v) for k, v in pipe.execute()[0].items()}
+	if not counters.get(LOADED_FIELD):
+		counters = load_campaign_counters(campaign)
+
+	return {counter: max(counters.get(counter, 0), 0) for counter in COUNTERS}
+
+def load_campaign_counters(campaign: str):
+	"""Count the campaign's messages from the database, when the counters are not in cache.
+	"""
+	counters = dict.fromkeys(COUNTERS, 0)
+	for status, count in frappe.db.sql("""SELECT status, COUNT(*) FROM `tabWhatsApp Message`
+		WHERE reference_doctype = 'WhatsApp Campaign' AND reference_document_name = %s
+		GROUP BY status""", campaign):
+		if STATUS_COUNTERS.get(status):
+			counters[STATUS_COUNTERS[status]] += count
+
+	counters[LOADED_FIELD] = 1
+	key = get_key(CAMPAIGN_COUNTERS_KEY.format(campaign))
+	pipe = frappe.cache().pipeline()
+	pipe.delete(key)
+	pipe.hset(key, mapping=counters)
+	pipe.execute()
+	return counters
+
+def rollup_campaign_counters():
+	"""Store the counters of campaigns that changed since the previous run on the campaigns.
+	"""
+	key = get_key(DIRTY_CAMPAIGNS_KEY)
+	pipe = frappe.cache().pipeline()
+	pipe.smembers(key)
+	pipe.delete(key)
+	campaigns, _ = pipe.execute()
+
+	for campaign in campaigns:
+		campaign = frappe.safe_decode(campaign)
+		if not frappe.db.exists('WhatsApp Campaign', campaign):
+			continue
+
+		counters = get_campaign_counters(campaign)
+		frappe.db.set_value('WhatsApp Campaign', campaign,
+			{'{}_count'.format(counter): value for counter, value in counters.items()},
+			update_modified=False
+		)
+	frappe.db.commit()
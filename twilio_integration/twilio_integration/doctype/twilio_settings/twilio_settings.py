@@ -15,6 +15,8 @@ from random import randrange
 
 from twilio.rest import Client
 from ...utils import get_public_url
+from ...twilio_handler import clear_voice_access_tokens, clear_recording_callback_url
+from ...pdf_optimizer import is_optimization_available
 
 class TwilioSettings(Document):
     friendly_resource_name = "ERPNext"
@@ -28,6 +30,9 @@ class TwilioSettings(Document):
         # Validate WhatsApp number format
         if self.whatsapp_no and not self.whatsapp_no.startswith('+'):
             frappe.throw(_("WhatsApp number must include country code (e.g., +1234567890)"))
+
+        if self.optimize_pdf and not is_optimization_available():
+            frappe.throw(_("PDF optimization needs the pikepdf package, install it on the bench first."))
     
 
     def on_update(self):
@@ -40,6 +45,9 @@ class TwilioSettings(Document):
         self.set_api_credentials(twilio)
         self.set_application_credentials(twilio)
         self.reload()
+        # Credentials may have changed, make browsers pick up freshly signed tokens
+        clear_voice_access_tokens()
+        clear_recording_callback_url()
         if self.enable_workflow_actions or self.enable_customer_orders:
             self.setup_twilio_webhooks()
 
@@ -81,7 +89,7 @@ class TwilioSettings(Document):
             frappe.throw(_("Twilio API credential creation error."))
 
     def get_twilio_voice_url(self):
-        url_path = "/api/method/twilio_integration.twilio_integration.api.voice"
+        url_path = "/api/method/twilio_integration.twilio_integration.api.voice.voice"
         return get_public_url(url_path)
 
     def get_application(self, twilio, friendly_name=None):
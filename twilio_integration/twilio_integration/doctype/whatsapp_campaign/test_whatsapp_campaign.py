@@ -1,8 +1,22 @@
 # Copyright (c) 2021, Frappe and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 import unittest
+from unittest.mock import patch
+
+from twilio_integration.twilio_integration import campaign_stats
 
 class TestWhatsAppCampaign(unittest.TestCase):
-	pass
+	def test_counters_are_loaded_once(self):
+		campaign = 'WA-CAMP-TEST-' + frappe.generate_hash(length=6)
+		key = campaign_stats.get_key(campaign_stats.CAMPAIGN_COUNTERS_KEY.format(campaign))
+		self.addCleanup(frappe.cache().delete, key)
+
+		with patch.object(campaign_stats, 'load_campaign_counters', wraps=campaign_stats.load_campaign_counters) as load:
+			campaign_stats.get_campaign_counters(campaign)
+			campaign_stats.record_status_change('WhatsApp Campaign', campaign, None, 'Sent')
+			counters = campaign_stats.get_campaign_counters(campaign)
+
+		self.assertEqual(load.call_count, 1)
+		self.assertEqual(counters['sent'], 1)
@@ -16,6 +16,7 @@ frappe.ui.form.on('WhatsApp Campaign', {
 						});
 					})
 					frappe.meta.get_docfield('WhatsApp Campaign Recipient', 'campaign_for', frm.doc.name).options = [""].concat(options);
+					frm.set_df_property('audience_doctype', 'options', [""].concat(options));
 				}
 			}
 		});
@@ -26,6 +27,22 @@ frappe.ui.form.on('WhatsApp Campaign', {
 			frm.disable_form();
 			frm.disable_save();
 		}
+		if(!frm.is_new() && frm.doc.status) {
+			// Live counters, the fields below are only rolled up every few minutes.
+			frappe.call({
+				method: 'twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.get_delivery_counters',
+				args: {campaign: frm.doc.name},
+				callback: function(r) {
+					if(r.message) {
+						let counters = r.message;
+						frm.dashboard.set_headline(
+							__('Queued: {0}, Sent: {1}, Delivered: {2}, Read: {3}, Failed: {4}',
+								[counters.queued, counters.sent, counters.delivered, counters.read, counters.failed])
+						);
+					}
+				}
+			});
+		}
 		if(!frm.is_new() && frm.doc.status!='Completed') {
 			frm.add_custom_button(('Send Now'), function(){
 				frappe.call({
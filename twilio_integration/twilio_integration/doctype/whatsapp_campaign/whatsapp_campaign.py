@@ -2,9 +2,12 @@
 # For license information, please see license.txt
 
 import frappe
+from frappe import _
 from frappe.model.document import Document
-from frappe.utils import get_site_url
 from twilio_integration.twilio_integration.doctype.whatsapp_message.whatsapp_message import WhatsAppMessage
+from twilio_integration.twilio_integration.media import get_signed_file_url
+from twilio_integration.twilio_integration.message_templates import MessageTemplate
+from twilio_integration.twilio_integration.campaign_stats import get_campaign_counters
 
 supported_file_ext = ['jpg', 
 	'jpeg',
@@ -16,9 +19,18 @@ supported_file_ext = ['jpg',
 	'mp4'
 ]
 
+# Keeps the IN list of a recipient number lookup bounded.
+RECIPIENT_LOOKUP_CHUNK_SIZE = 1000
+# Recipients of a dynamic audience are read and messaged this many at a time.
+AUDIENCE_CHUNK_SIZE = 500
+WHATSAPP_FIELDNAME = 'whatsapp_no'
+WHATSAPP_DOCTYPES_CACHE_KEY = 'whatsapp_campaign_doctypes'
+
 class WhatsAppCampaign(Document):
 	def validate(self):
-		if self.scheduled_time and self.status != 'Completed':
+		# A failed campaign keeps its past time until it is rescheduled, so it can be corrected and resent.
+		rescheduled = self.status != 'Failed' or self.has_value_changed('scheduled_time')
+		if self.scheduled_time and self.status != 'Completed' and rescheduled:
 			current_time = frappe.utils.now_datetime()
 			scheduled_time = frappe.utils.get_datetime(self.scheduled_time)
 
@@ -27,7 +39,10 @@ class WhatsAppCampaign(Document):
 
 			self.status = 'Scheduled'
 
-		self.all_missing_recipients()
+		if self.audience_type == 'Dynamic':
+			self.total_participants = frappe.db.count(self.audience_doctype, self.get_audience_filters())
+		else:
+			self.all_missing_recipients()
 	
 	def validate_attachment(self):
 		attachment = self.get_attachment()
@@ -35,59 +50,245 @@ class WhatsAppCampaign(Document):
 			if attachment.file_size > 16777216:
 				frappe.throw(_('Attachment size must be less than 16MB.'))
 
-			if attachment.is_private:
-				frappe.throw(_('Attachment must be public.'))
-
 			if attachment.get_extension() not in supported_file_ext:
 				frappe.throw(_('Attachment format not supported.'))
 
 	def get_attachment(self):
-		file = frappe.db.get_value("File", {"attached_to_name": self.doctype, "attached_to_doctype": self.name, "is_private":0}, 'name')
+		file = frappe.db.get_value("File", {"attached_to_doctype": self.doctype, "attached_to_name": self.name}, 'name')
 
 		if file:
 			return frappe.get_doc('File', file)
 		return None
 
+	def get_audience_filters(self):
+		"""Condition of a dynamic audience as `frappe.get_all` filters, limited to records with a number.
+		"""
+		try:
+			condition = frappe.parse_json(self.condition) if self.condition else {}
+		except ValueError:
+			frappe.throw(_('Condition must be valid JSON.'))
+
+		if isinstance(condition, dict):
+			filters = [[self.audience_doctype, key, *(value if isinstance(value, list) else ['=', value])]
+				for key, value in condition.items()]
+		elif isinstance(condition, list):
+			filters = list(condition)
+		else:
+			frappe.throw(_('Condition must be a JSON object or a list of filters.'))
+
+		filters.append([self.audience_doctype, get_whatsapp_field(self.audience_doctype), 'is', 'set'])
+		return filters
+
+	def iter_audience(self, fields=None, chunk_size=AUDIENCE_CHUNK_SIZE, after=None):
+		"""Yield records (name, whatsapp_no and `fields`) of a dynamic audience a chunk at a time,
+		starting after the record named `after`. Pages are read after the last seen name, so each
+		query stays an index range scan and only one chunk is held in memory whatever the audience size.
+		"""
+		filters = self.get_audience_filters()
+		last_name = after
+		while True:
+			page_filters = filters + [[self.audience_doctype, 'name', '>', last_name]] if last_name else filters
+			rows = frappe.get_all(self.audience_doctype,
+				filters=page_filters,
+				fields=['name', '{} as whatsapp_no'.format(get_whatsapp_field(self.audience_doctype)), *(fields or [])],
+				order_by='name asc',
+				limit_page_length=chunk_size
+			)
+			if not rows:
+				break
+
+			yield rows
+			last_name = rows[-1].name
+
 	def get_whatsapp_contact(self):
 		contacts = [recipient.whatsapp_no for recipient in self.recipients if recipient.whatsapp_no]
 
 		return contacts
+
+	def get_recipient_records(self, template):
+		"""Recipient rows with the fields their template reads, one query per recipient doctype.
+		"""
+		records = []
+		recipients_by_doctype = {}
+		for recipient in self.recipients:
+			if recipient.whatsapp_no:
+				recipients_by_doctype.setdefault(recipient.campaign_for, []).append(recipient)
+
+		for campaign_for, recipients in recipients_by_doctype.items():
+			fields = template.get_fields(campaign_for)
+			prefetched = get_recipient_records(campaign_for, list({r.recipient for r in recipients}), fields) if fields else {}
+			for recipient in recipients:
+				records.append({
+					**prefetched.get(recipient.recipient, {}),
+					'name': recipient.recipient,
+					'whatsapp_no': recipient.whatsapp_no
+				})
+		return records
 	
 	def all_missing_recipients(self):
+		"""Fill missing numbers with one query per recipient doctype (per chunk of recipients).
+		"""
+		missing = {}
 		for recipient in self.recipients:
-			if not recipient.whatsapp_no:
-				recipient.whatsapp_no = frappe.db.get_value(recipient.campaign_for, recipient.recipient, 'whatsapp_no')
-		
+			if not recipient.whatsapp_no and recipient.campaign_for and recipient.recipient:
+				missing.setdefault(recipient.campaign_for, []).append(recipient)
+
+		for campaign_for, recipients in missing.items():
+			records = get_recipient_records(campaign_for, list({r.recipient for r in recipients}),
+				['{} as whatsapp_no'.format(get_whatsapp_field(campaign_for))])
+			for recipient in recipients:
+				recipient.whatsapp_no = records.get(recipient.recipient, {}).get('whatsapp_no')
+
 		self.total_participants = len(self.recipients)
 
 	@frappe.whitelist()
 	def get_doctype_list(self):
-		standard_doctype = frappe.db.sql_list("""SELECT dt.parent FROM `tabDocField` 
-			df INNER JOIN `tabDoctype` dt ON dt.name = dt.parent
-			WHERE df.fieldname='whatsapp_no' AND dt.istable = 0 AND dt.issingle = 0 AND dt.is_tree = 0""")
-		
-		custom_doctype = frappe.db.sql_list("""SELECT dt FROM `tabCustom Field`
-			cf INNER JOIN `tabDoctype` dt ON dt.name = cf.dt
-			WHERE cf.fieldname='whatsapp_no' AND dt.istable = 0 AND dt.issingle = 0 AND dt.is_tree = 0""")
-
-		return standard_doctype + custom_doctype
+		return list(get_whatsapp_doctypes())
 
 	@frappe.whitelist()
 	def send_now(self):
+		self.db_set('status', 'In Progress')
+		if self.audience_type == 'Dynamic':
+			# Large audiences are sent from a worker, not within the request.
+			frappe.enqueue(
+				'twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.send_scheduled_campaign',
+				queue='long',
+				campaign=self.name
+			)
+		else:
+			self.send()
+
+	def send(self):
 		self.validate_attachment()
 		media = self.get_attachment()
-		self.db_set('status', 'In Progress')
 		if media:
-			media = get_site_url(frappe.local.site) + media.file_url
+			# Signed URL lets Twilio fetch private attachments without a public copy
+			media = get_signed_file_url(media.file_url)
+
+		template = MessageTemplate.for_doc(self)
+		skipped = 0
+		if self.audience_type == 'Dynamic':
+			# A campaign that failed part way resumes after the last chunk committed.
+			for records in self.iter_audience(template.get_fields(self.audience_doctype), after=self.last_sent_name):
+				skipped += len(self.send_to_records(template, records, media))
+				self.db_set('last_sent_name', records[-1].name, update_modified=False)
+				# Keep the transaction bounded by the chunk, not by the audience.
+				frappe.db.commit()
+			self.db_set('last_sent_name', None, update_modified=False)
+		else:
+			skipped = len(self.send_to_records(template, self.get_recipient_records(template), media))
+
+		if skipped:
+			self.add_comment('Comment', _('{0} recipients were skipped for an invalid, repeated or suppressed WhatsApp number. Invalid numbers are listed in the Error Log.').format(skipped))
+		self.db_set('status', 'Completed')
 
-		WhatsAppMessage.send_whatsapp_message(
-			receiver_list = self.get_whatsapp_contact(),
-			message = self.message,
+	def send_to_records(self, template, records, media=None):
+		"""Send the campaign message to the recipients, personalized when it is a template.
+		Returns the numbers that were skipped.
+		"""
+		if not template.is_dynamic:
+			return WhatsAppMessage.send_whatsapp_message(
+				receiver_list = [record['whatsapp_no'] for record in records],
+				message = self.message,
+				doctype = self.doctype,
+				docname = self.name,
+				media = media
+			)
+
+		bodies = template.render_for_records(records, {'campaign': self})
+		return WhatsAppMessage.send_whatsapp_messages(
+			messages = {record['whatsapp_no']: body for record, body in zip(records, bodies)},
 			doctype = self.doctype,
 			docname = self.name,
 			media = media
 		)
 
-		self.db_set('status', 'Completed')
 
+def get_whatsapp_doctypes():
+	"""Doctypes that can be campaign audiences, mapped to the field holding their WhatsApp number.
+	Cached until a DocType or Custom Field changes.
+	>>> get_whatsapp_doctypes()
+	... {'Customer': 'whatsapp_no', 'Lead': 'whatsapp_no'}
+	"""
+	def _get_doctypes():
+		return dict(frappe.db.sql("""
+			SELECT df.parent, df.fieldname FROM `tabDocField` df
+			INNER JOIN `tabDocType` dt ON dt.name = df.parent
+			WHERE df.parenttype = 'DocType' AND df.fieldname = %(fieldname)s
+				AND dt.istable = 0 AND dt.issingle = 0 AND dt.is_tree = 0
+			UNION
+			SELECT cf.dt, cf.fieldname FROM `tabCustom Field` cf
+			INNER JOIN `tabDocType` dt ON dt.name = cf.dt
+			WHERE cf.fieldname = %(fieldname)s
+				AND dt.istable = 0 AND dt.issingle = 0 AND dt.is_tree = 0
+			ORDER BY 1
+		""", {'fieldname': WHATSAPP_FIELDNAME}))
+	return frappe.cache().get_value(WHATSAPP_DOCTYPES_CACHE_KEY, generator=_get_doctypes)
+
+def get_whatsapp_field(doctype):
+	fieldname = get_whatsapp_doctypes().get(doctype)
+	if not fieldname:
+		frappe.throw(_('{0} has no WhatsApp number field.').format(doctype))
+	return fieldname
+
+def clear_whatsapp_doctypes(doc=None, method=None):
+	frappe.cache().delete_value(WHATSAPP_DOCTYPES_CACHE_KEY)
+
+def get_recipient_records(doctype, names, fields):
+	"""Given fields of the records, by record name.
+	>>> get_recipient_records('Customer', ['Jane Stores', 'Acme'], ['whatsapp_no'])
+	... {'Jane Stores': {'name': 'Jane Stores', 'whatsapp_no': '+256770787451'}, 'Acme': {...}}
+	"""
+	records = {}
+	for i in range(0, len(names), RECIPIENT_LOOKUP_CHUNK_SIZE):
+		for record in frappe.get_all(doctype,
+			filters={'name': ['in', names[i:i + RECIPIENT_LOOKUP_CHUNK_SIZE]]},
+			fields=['name', *fields]
+		):
+			records[record.name] = record
+	return records
+
+@frappe.whitelist()
+def get_delivery_counters(campaign):
+	frappe.has_permission('WhatsApp Campaign', doc=campaign, throw=True)
+	return get_campaign_counters(campaign)
+
+def on_doctype_update():
+	# The scheduler reads due campaigns by status and time, keep that a range scan.
+	frappe.db.add_index("WhatsApp Campaign", ["status", "scheduled_time"])
+
+def launch_scheduled_campaigns():
+	"""Runs every minute, hands campaigns whose scheduled time has come to background workers.
+	"""
+	due_campaigns = frappe.db.sql_list("""SELECT name FROM `tabWhatsApp Campaign`
+		WHERE status = 'Scheduled' AND scheduled_time <= %s
+		ORDER BY scheduled_time""", frappe.utils.now_datetime())
+
+	for campaign in due_campaigns:
+		if claim_campaign(campaign):
+			frappe.enqueue(
+				'twilio_integration.twilio_integration.doctype.whatsapp_campaign.whatsapp_campaign.send_scheduled_campaign',
+				queue='long',
+				campaign=campaign
+			)
+
+def claim_campaign(campaign):
+	"""Move a due campaign to In Progress, only one of several concurrent runs succeeds.
+	"""
+	# The row lock makes a concurrent claim wait for this one and then see it.
+	claimed = frappe.db.get_value('WhatsApp Campaign', campaign, 'status', for_update=True) == 'Scheduled'
+	if claimed:
+		frappe.db.set_value('WhatsApp Campaign', campaign, 'status', 'In Progress')
+	# Make the claim visible to other workers before the send is queued.
+	frappe.db.commit()
+	return claimed
 
+def send_scheduled_campaign(campaign):
+	doc = frappe.get_doc('WhatsApp Campaign', campaign)
+	try:
+		doc.send()
+	except Exception:
+		frappe.db.rollback()
+		# The campaign can be corrected and sent again, dynamic audiences continue after `last_sent_name`.
+		doc.db_set('status', 'Failed')
+		frappe.log_error(title=_('Failed to send WhatsApp Campaign {0}').format(campaign))
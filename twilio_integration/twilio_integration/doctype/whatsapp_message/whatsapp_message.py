@@ -8,6 +8,12 @@ from frappe.utils.password import get_decrypted_password
 from frappe.utils import get_site_url
 from frappe import _
 from ...twilio_handler import Twilio
+from ...phone_numbers import normalize_numbers, log_rejected_numbers
+from ...suppression import filter_suppressed, process_inbound_keyword, SUPPRESSED
+from ...campaign_stats import record_status_change, is_status_forward
+from ...outbound import queue_outbound_message
+
+STATUS_CALLBACK_PATH = '/api/method/twilio_integration.twilio_integration.api.whatsapp_messages.whatsapp_message_status_callback'
 
 class WhatsAppMessage(Document):
 	def send(self):
@@ -26,13 +32,25 @@ class WhatsAppMessage(Document):
 		except Exception as e:
 			self.db_set('status', "Error")
 			frappe.log_error(e, title = _('Twilio WhatsApp Message Error'))
+
+		record_status_change(self.reference_doctype, self.reference_document_name, None, self.status)
+
+	def update_status(self, status):
+		"""Apply a status callback, keeping the campaign counters in step.
+		"""
+		if not is_status_forward(self.status, status):
+			return
+
+		old_status = self.status
+		self.db_set('status', status)
+		record_status_change(self.reference_doctype, self.reference_document_name, old_status, status)
 	
 	def get_message_dict(self):
 		args = {
 			'from_': self.from_,
 			'to': self.to,
 			'body': self.message,
-			'status_callback': '{}/api/method/twilio_integration.twilio_integration.api.whatsapp_message_status_callback'.format(get_site_url(frappe.local.site))
+			'status_callback': get_status_callback_url()
 		}
 		if self.media_link:
 			args['media_url'] = [self.media_link]
@@ -40,15 +58,42 @@ class WhatsAppMessage(Document):
 		return args
 
 	@classmethod
-	def send_whatsapp_message(self, receiver_list, message, doctype, docname, media=None):
+	def send_whatsapp_message(self, receiver_list, message, doctype, docname, media=None, source=None):
+		"""Send a message to every receiver.
+		With a `source`, messages may be held back and combined with others to the same receiver.
+		"""
 		if isinstance(receiver_list, string_types):
 			receiver_list = loads(receiver_list)
 			if not isinstance(receiver_list, list):
 				receiver_list = [receiver_list]
 
-		for rec in receiver_list:
-			message = self.store_whatsapp_message(rec, message, doctype, docname)
-			message.send()
+		# Invalid, repeated and suppressed numbers are dropped before any message is created.
+		receivers, rejected = normalize_numbers(receiver_list)
+		log_rejected_numbers(rejected, doctype, docname)
+		receivers, suppressed = filter_suppressed(list(receivers))
+		rejected += [(number, SUPPRESSED) for number in suppressed]
+
+		for rec in receivers:
+			if source and not media and queue_outbound_message(rec, message, source, doctype, docname):
+				continue
+			wa_msg = self.store_whatsapp_message(rec, message, doctype, docname, media)
+			wa_msg.send()
+		return rejected
+
+	@classmethod
+	def send_whatsapp_messages(self, messages, doctype, docname, media=None):
+		"""Send a personalized body to each receiver, `messages` maps receiver numbers to bodies.
+		"""
+		receivers, rejected = normalize_numbers(list(messages))
+		log_rejected_numbers(rejected, doctype, docname)
+		allowed, suppressed = filter_suppressed(list(receivers))
+		rejected += [(receivers[number], SUPPRESSED) for number in suppressed]
+
+		for rec in allowed:
+			number = receivers[rec]
+			wa_msg = self.store_whatsapp_message(rec, messages[number], doctype, docname, media)
+			wa_msg.send()
+		return rejected
 
 	def store_whatsapp_message(to, message, doctype=None, docname=None, media=None):
 		sender = frappe.db.get_single_value('whatsapp integration settings', 'twilio_number')
@@ -77,3 +122,14 @@ def incoming_message_callback(args):
 			'status': 'Received'
 		}).insert(ignore_permissions=True)
 
+	process_inbound_keyword(args.From, args.Body)
+
+def get_status_callback_url():
+	"""Status callback of sent messages, also feeds undeliverable numbers to the suppression list.
+	"""
+	return get_site_url(frappe.local.site) + STATUS_CALLBACK_PATH
+
+def on_doctype_update():
+	# Status callbacks find messages by id, campaign counters are rebuilt by reference.
+	frappe.db.add_index("WhatsApp Message", ["id"])
+	frappe.db.add_index("WhatsApp Message", ["reference_doctype", "reference_document_name"])
@@ -0,0 +1,8 @@
+# Copyright (c) 2026, Frappe and Contributors
+# See license.txt
+
+# import frappe
+import unittest
+
+class TestWhatsAppSuppression(unittest.TestCase):
+	pass
@@ -0,0 +1,28 @@
+# Copyright (c) 2026, Frappe and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from twilio_integration.twilio_integration.phone_numbers import normalize_number
+from twilio_integration.twilio_integration import suppression
+
+class WhatsAppSuppression(Document):
+	def before_insert(self):
+		# Named after the number, normalize it before the name is set.
+		self.validate_whatsapp_no()
+
+	def validate(self):
+		self.validate_whatsapp_no()
+
+	def validate_whatsapp_no(self):
+		whatsapp_no = normalize_number(self.whatsapp_no)
+		if not whatsapp_no:
+			frappe.throw(_('{0} is not a valid WhatsApp number.').format(self.whatsapp_no))
+		self.whatsapp_no = whatsapp_no
+
+	def on_update(self):
+		suppression.add_to_suppression_set(self.whatsapp_no)
+
+	def on_trash(self):
+		suppression.remove_from_suppression_set(self.whatsapp_no)
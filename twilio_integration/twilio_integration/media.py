@@ -0,0 +1,155 @@
+import os
+import hmac
+import time
+import hashlib
+from urllib.parse import urlencode
+from werkzeug.utils import send_file
+
+import frappe
+from frappe import _
+from frappe.utils import get_url
+from frappe.utils.password import get_encryption_key
+
+# Staged media lives outside `public/files` and is only reachable through signed URLs.
+MEDIA_FOLDER = 'whatsapp_media'
+MEDIA_URL_TTL = 24 * 60 * 60
+SERVE_MEDIA_PATH = "/api/method/twilio_integration.twilio_integration.media.serve_media"
+SERVABLE_FOLDERS = (('private', MEDIA_FOLDER), ('private', 'files'), ('public', 'files'))
+
+# Redis sorted set of staged file names scored by their expiry timestamp.
+MEDIA_MANIFEST_KEY = 'whatsapp_media_manifest'
+MEDIA_PURGE_BATCH_SIZE = 500
+
+
+def get_media_folder():
+	return frappe.get_site_path('private', MEDIA_FOLDER)
+
+def stage_media(content: bytes, extension: str='pdf', ttl: int=MEDIA_URL_TTL):
+	"""Write media into the private staging folder and return a signed URL for it.
+	The file is recorded in the manifest so that it is purged once the URL expires.
+	"""
+	folder = get_media_folder()
+	frappe.create_folder(folder)
+
+	# Expiry is part of the name so that the manifest can be rebuilt from the folder.
+	expires = int(time.time()) + ttl
+	file_name = '{}-{}.{}'.format(expires, frappe.generate_hash(length=20), extension)
+	with open(os.path.join(folder, file_name), 'wb') as f:
+		f.write(content)
+
+	frappe.cache().zadd(get_manifest_key(), {file_name: expires})
+	return get_signed_url(os.path.join('private', MEDIA_FOLDER, file_name), ttl)
+
+def get_signed_file_url(file_url: str, ttl: int=MEDIA_URL_TTL):
+	"""Signed URL for a `File` url, so that private attachments need no public copy.
+	>>> get_signed_file_url('/private/files/invoice.pdf')
+	... 'https://site/api/method/...serve_media?path=private%2Ffiles%2Finvoice.pdf&expires=..&signature=..'
+	"""
+	if file_url.startswith('/private/'):
+		path = file_url.lstrip('/')
+	else:
+		path = os.path.join('public', file_url.lstrip('/'))
+	return get_signed_url(path, ttl)
+
+def get_signed_url(path: str, ttl: int=MEDIA_URL_TTL):
+	"""Build an expiring URL for a site relative path.
+	"""
+	expires = int(time.time()) + ttl
+	query = urlencode({
+		'path': path,
+		'expires': expires,
+		'signature': sign(path, expires)
+	})
+	return get_url('{}?{}'.format(SERVE_MEDIA_PATH, query))
+
+def sign(path: str, expires):
+	key = get_encryption_key().encode()
+	message = '{}:{}'.format(path, expires).encode()
+	return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+def get_servable_path(path: str):
+	"""Resolve a site relative path, refusing anything outside the servable folders.
+	"""
+	site_path = os.path.realpath(frappe.get_site_path())
+	full_path = os.path.realpath(os.path.join(site_path, path))
+	for folder in SERVABLE_FOLDERS:
+		if full_path.startswith(os.path.join(site_path, *folder) + os.sep):
+			return full_path
+
+@frappe.whitelist(allow_guest=True)
+def serve_media(path, expires, signature):
+	"""Stream a staged media file to Twilio (or any holder of a valid signed URL).
+
+	The file is handed to the WSGI server's file wrapper (sendfile where available)
+	and served conditionally, so ETag revalidation and Range requests are honoured.
+	"""
+	if not hmac.compare_digest(sign(path, expires), signature or ''):
+		raise frappe.PermissionError(_('Invalid media signature.'))
+
+	remaining = int(expires) - int(time.time())
+	if remaining <= 0:
+		raise frappe.PermissionError(_('Media link has expired.'))
+
+	full_path = get_servable_path(path)
+	if not (full_path and os.path.isfile(full_path)):
+		raise frappe.DoesNotExistError(_('Media not found.'))
+
+	return send_file(
+		full_path,
+		frappe.request.environ,
+		conditional=True,
+		etag=True,
+		max_age=remaining
+	)
+
+def get_manifest_key():
+	return frappe.cache().make_key(MEDIA_MANIFEST_KEY)
+
+def rebuild_media_manifest():
+	"""Recreate the manifest from the staging folder, e.g. after the cache was flushed.
+	"""
+	folder = get_media_folder()
+	if not os.path.isdir(folder):
+		return
+
+	entries = {}
+	for file_name in os.listdir(folder):
+		expires = file_name.split('-', 1)[0]
+		# Files staged before expiry was encoded in the name are expired right away.
+		entries[file_name] = int(expires) if expires.isdigit() else 0
+
+	if entries:
+		frappe.cache().zadd(get_manifest_key(), entries)
+
+def purge_expired_media(batch_size: int=MEDIA_PURGE_BATCH_SIZE):
+	"""Delete staged media whose signed URLs have expired.
+
+	Only expired entries are read from the manifest, so the cost of a run depends on
+	the number of expired files and not on the size of the files folder.
+	"""
+	cache = frappe.cache()
+	key = get_manifest_key()
+	if not cache.zcard(key):
+		rebuild_media_manifest()
+
+	folder = get_media_folder()
+	now = int(time.time())
+	purged = 0
+	while True:
+		file_names = [frappe.safe_decode(name) for name in
+			cache.zrangebyscore(key, '-inf', now, start=0, num=batch_size)]
+		if not file_names:
+			break
+
+		for file_name in file_names:
+			try:
+				os.remove(os.path.join(folder, file_name))
+			except FileNotFoundError:
+				pass
+
+		cache.zrem(key, *file_names)
+		purged += len(file_names)
+		if len(file_names) < batch_size:
+			break
+
+	return purged
@@ -0,0 +1,91 @@
+"""Compiled Jinja message bodies shared across sends.
+
+A template is compiled once per worker and reused until the document holding it
+is modified, only the most recently used ones are kept. Campaigns render a body per
+recipient from fields fetched along with the audience, so personalization costs no
+query per recipient.
+"""
+from functools import lru_cache
+
+from jinja2 import nodes
+
+import frappe
+from frappe import _
+from frappe.model import default_fields
+
+# Compiled templates kept per worker, across all its sites.
+COMPILED_TEMPLATE_CACHE_SIZE = 256
+
+
+class MessageTemplate:
+	def __init__(self, doctype: str, name: str, modified, source: str):
+		"""
+		:param doctype, name: document holding the template, identifies it in the registry
+		:param modified: `modified` of that document, a change recompiles the template
+		"""
+		self.doctype = doctype
+		self.name = name
+		self.modified = str(modified)
+		self.source = source or ''
+
+	@classmethod
+	def for_doc(cls, doc, fieldname='message'):
+		return cls(doc.doctype, doc.name, doc.modified, doc.get(fieldname))
+
+	@property
+	def is_dynamic(self):
+		"""Static bodies are sent as they are, without rendering per recipient.
+		"""
+		return '{{' in self.source or '{%' in self.source
+
+	def get_compiled(self):
+		return compile_template(frappe.local.site, self.doctype, self.name, self.modified, self.source)
+
+	def render(self, context: dict):
+		if not self.is_dynamic:
+			return self.source
+		return self.get_compiled()[0].render(context)
+
+	def render_for_records(self, records: list, context: dict=None):
+		"""A body per record, each record is passed to the template as `doc`.
+		>>> MessageTemplate.for_doc(campaign).render_for_records([{'customer_name': 'Jane'}])
+		... ['Hi Jane, our sale starts today!']
+		"""
+		context = context or {}
+		return [self.render({**context, 'doc': frappe._dict(record)}) for record in records]
+
+	def get_fields(self, doctype: str):
+		"""Fields of `doctype` the template reads from `doc`, to fetch along with the recipients.
+		"""
+		if not self.is_dynamic:
+			return []
+
+		meta = frappe.get_meta(doctype)
+		return [field for field in self.get_compiled()[1]
+			if meta.has_field(field) or field in default_fields]
+
+
+@lru_cache(maxsize=COMPILED_TEMPLATE_CACHE_SIZE)
+def compile_template(site: str, doctype: str, name: str, modified: str, source: str):
+	"""Compiled template and the fields it reads from `doc`, keyed by the document's `modified`
+	so that an edit compiles afresh and the stale entry ages out.
+	"""
+	# Same restriction as frappe.render_template
+	if '.__' in source:
+		frappe.throw(_('Illegal template'))
+
+	jenv = frappe.get_jenv()
+	return jenv.from_string(source), get_doc_fields(jenv.parse(source))
+
+def get_doc_fields(template_ast):
+	"""Attributes and constant keys read from `doc`, e.g. `{{ doc.first_name }}` or `{{ doc['city'] }}`.
+	"""
+	fields = set()
+	for node in template_ast.find_all((nodes.Getattr, nodes.Getitem)):
+		if not (isinstance(node.node, nodes.Name) and node.node.name == 'doc'):
+			continue
+		if isinstance(node, nodes.Getattr):
+			fields.add(node.attr)
+		elif isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+			fields.add(node.arg.value)
+	return fields
@@ -0,0 +1,105 @@
+"""Coalesce WhatsApp messages sent to the same recipient within a short window.
+
+Document events often message the same approver or customer several times within
+seconds (workflow notification, approval request, Notification channel). With a
+window set in `Twilio Settings`, such messages are buffered per recipient in Redis
+and sent as one combined message by the per-minute job once the window of the
+first one has closed.
+"""
+import json
+import time
+
+import frappe
+from .phone_numbers import normalize_number
+
+# Sources passed by the senders, listed in `Twilio Settings` to always send alone.
+NOTIFICATION = 'Notification'
+WORKFLOW_NOTIFICATION = 'Workflow Notification'
+WORKFLOW_CONFIRMATION = 'Workflow Confirmation'
+SALES_ORDER_APPROVAL = 'Sales Order Approval'
+# Combined messages go out the way their source sends, from the same account and number.
+# Sources not listed send through `WhatsApp Message`.
+SOURCE_SENDERS = {
+	WORKFLOW_NOTIFICATION: 'twilio_integration.services.whatsapp_order_chatbot.send_message',
+	WORKFLOW_CONFIRMATION: 'twilio_integration.services.whatsapp_order_chatbot.send_message',
+	SALES_ORDER_APPROVAL: 'twilio_integration.services.simple_whatsapp_approval.send_whatsapp_text'
+}
+
+OUTBOUND_BUFFER_KEY = 'whatsapp_outbound_buffer:{}'
+# Recipients with buffered messages, scored by the time their window closes.
+OUTBOUND_DUE_KEY = 'whatsapp_outbound_due'
+# Messages wait up to a scheduler minute past their window, keep windows short.
+MAX_COALESCE_WINDOW = 60
+MESSAGE_SEPARATOR = '\n\n━━━━━━━━━━\n\n'
+
+
+def get_key(key: str):
+	return frappe.cache().make_key(key)
+
+def get_coalesce_settings():
+	settings = frappe.get_cached_doc('Twilio Settings')
+	window = min(settings.coalesce_window or 0, MAX_COALESCE_WINDOW)
+	send_alone = {source.strip() for source in (settings.coalesce_excluded_sources or '').splitlines() if source.strip()}
+	return window, send_alone
+
+def queue_outbound_message(to: str, body: str, source: str, reference_doctype=None, reference_name=None):
+	"""Buffer a message to be sent combined with others to the same recipient.
+	Returns False when coalescing doesn't apply and the caller has to send the message itself.
+	"""
+	window, send_alone = get_coalesce_settings()
+	if not window or source in send_alone:
+		return False
+
+	to = normalize_number(to)
+	if not to:
+		return False
+
+	pipe = frappe.cache().pipeline()
+	pipe.rpush(get_key(OUTBOUND_BUFFER_KEY.format(to)), json.dumps({
+		'body': body,
+		'source': source,
+		'reference_doctype': reference_doctype,
+		'reference_name': reference_name
+	}))
+	# The window is opened by the first buffered message and not extended by later ones.
+	pipe.zadd(get_key(OUTBOUND_DUE_KEY), {to: time.time() + window}, nx=True)
+	pipe.execute()
+	return True
+
+def send_due_messages():
+	"""Runs every minute, sends the combined message of every recipient whose window has closed.
+	"""
+	from .doctype.whatsapp_message.whatsapp_message import WhatsAppMessage
+
+	cache = frappe.cache()
+	due_key = get_key(OUTBOUND_DUE_KEY)
+	for to in cache.zrangebyscore(due_key, '-inf', time.time()):
+		to = frappe.safe_decode(to)
+		buffer_key = get_key(OUTBOUND_BUFFER_KEY.format(to))
+
+		pipe = cache.pipeline()
+		pipe.lrange(buffer_key, 0, -1)
+		pipe.delete(buffer_key)
+		pipe.zrem(due_key, to)
+		messages = [json.loads(message) for message in pipe.execute()[0]]
+
+		# Only messages of sources sharing a sender can be combined.
+		by_sender = {}
+		for message in messages:
+			by_sender.setdefault(SOURCE_SENDERS.get(message['source']), []).append(message)
+
+		for sender, sender_messages in by_sender.items():
+			body = MESSAGE_SEPARATOR.join(message['body'] for message in sender_messages)
+			try:
+				if sender:
+					frappe.get_attr(sender)(to, body)
+				else:
+					WhatsAppMessage.send_whatsapp_message(
+						receiver_list=[to],
+						message=body,
+						doctype=sender_messages[0]['reference_doctype'],
+						docname=sender_messages[0]['reference_name']
+					)
+			except Exception:
+				frappe.log_error(title='Failed to send coalesced WhatsApp message to {}'.format(to))
+		frappe.db.commit()
@@ -0,0 +1,101 @@
+from io import BytesIO
+
+import frappe
+
+try:
+	import pikepdf
+except ImportError:
+	pikepdf = None
+
+# WhatsApp rejects media above 16MB.
+WHATSAPP_MEDIA_SIZE_LIMIT = 16 * 1024 * 1024
+
+# Each pass recompresses images harder until the PDF fits the size budget.
+IMAGE_QUALITY_STEPS = (85, 70, 50)
+IMAGE_MAX_DIMENSION = 2000
+
+
+def get_size_budget():
+	"""Target size in bytes configured in `Twilio Settings`, bounded by the WhatsApp limit.
+	"""
+	budget_kb = frappe.db.get_single_value('Twilio Settings', 'pdf_size_budget')
+	budget = (budget_kb or 0) * 1024
+	return min(budget, WHATSAPP_MEDIA_SIZE_LIMIT) if budget else WHATSAPP_MEDIA_SIZE_LIMIT
+
+def is_optimization_available():
+	return pikepdf is not None
+
+def is_optimization_enabled():
+	return is_optimization_available() and bool(frappe.db.get_single_value('Twilio Settings', 'optimize_pdf'))
+
+def optimize_pdf(content: bytes, size_budget: int=None):
+	"""Recompress images, drop unused resources and linearize a PDF.
+	Returns the smallest result along with its size before and after.
+	>>> optimize_pdf(pdf_content, size_budget=2 * 1024 * 1024)
+	... (b'%PDF-1.7...', {'original_size': 5242880, 'optimized_size': 1887436})
+	"""
+	size_budget = size_budget or get_size_budget()
+	original_size = len(content)
+	optimized = content
+
+	# Without pikepdf the setting can't be saved, PDFs are sent as generated.
+	if pikepdf:
+		for quality in IMAGE_QUALITY_STEPS:
+			candidate = rewrite_pdf(content, quality)
+			if len(candidate) < len(optimized):
+				optimized = candidate
+			if len(optimized) <= size_budget:
+				break
+
+	return optimized, {
+		'original_size': original_size,
+		'optimized_size': len(optimized)
+	}
+
+def rewrite_pdf(content: bytes, quality: int):
+	"""Rewrite the PDF with recompressed images and a linearized layout.
+	Fonts are left as embedded, wkhtmltopdf already writes them subsetted.
+	"""
+	with pikepdf.open(BytesIO(content)) as pdf:
+		for page in pdf.pages:
+			for raw_image in page.images.values():
+				recompress_image(raw_image, quality)
+		pdf.remove_unreferenced_resources()
+
+		output = BytesIO()
+		pdf.save(output,
+			compress_streams=True,
+			recompress_flate=True,
+			object_stream_mode=pikepdf.ObjectStreamMode.generate,
+			linearize=True
+		)
+		return output.getvalue()
+
+def recompress_image(raw_image, quality: int):
+	"""Replace an image stream with a downscaled JPEG when that is smaller.
+	Images with transparency masks are kept as they are.
+	"""
+	if raw_image.get('/SMask') or raw_image.get('/Mask'):
+		return
+
+	try:
+		image = pikepdf.PdfImage(raw_image).as_pil_image()
+	except Exception:
+		# Unsupported colour spaces or filters, keep the original stream.
+		return
+
+	image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+	buffer = BytesIO()
+	image.convert('RGB').save(buffer, format='JPEG', quality=quality, optimize=True)
+	jpeg = buffer.getvalue()
+
+	if len(jpeg) >= len(raw_image.read_raw_bytes()):
+		return
+
+	raw_image.write(jpeg, filter=pikepdf.Name.DCTDecode)
+	raw_image.ColorSpace = pikepdf.Name.DeviceRGB
+	raw_image.BitsPerComponent = 8
+	raw_image.Width, raw_image.Height = image.size
+	for key in ('/DecodeParms', '/Decode'):
+		if key in raw_image:
+			del raw_image[key]
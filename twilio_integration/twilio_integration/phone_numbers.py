@@ -0,0 +1,131 @@
+"""Batch E.164 normalization of recipient numbers.
+
+Numbers are checked against the possible lengths of their country calling code,
+taken once from libphonenumber's numbering plan metadata. A list is normalized,
+validated and deduplicated in one pass of dict lookups, so malformed numbers are
+dropped before a Twilio API call is spent on them.
+"""
+import re
+
+import frappe
+
+try:
+	import phonenumbers
+except ImportError:
+	phonenumbers = None
+
+# E.164 allows at most 15 digits including the country code.
+E164_MAX_DIGITS = 15
+E164_MIN_DIGITS = 8
+SEPARATORS = re.compile(r'[\s().\-/]')
+NOT_DIGITS = re.compile(r'\D')
+
+INVALID_FORMAT = 'invalid format'
+UNKNOWN_COUNTRY_CODE = 'unknown country code'
+INVALID_LENGTH = 'invalid length for country'
+DUPLICATE = 'duplicate'
+
+_possible_lengths = None
+
+
+def get_possible_lengths():
+	"""National number lengths per country calling code, e.g. {'1': {10}, '44': {7, 9, 10}, ..}.
+	"""
+	global _possible_lengths
+	if _possible_lengths is None:
+		lengths = {}
+		if phonenumbers:
+			for country_code, regions in phonenumbers.COUNTRY_CODE_TO_REGION_CODE.items():
+				for region in regions:
+					metadata = phonenumbers.PhoneMetadata.metadata_for_region_or_calling_code(country_code, region)
+					if metadata and metadata.general_desc and metadata.general_desc.possible_length:
+						lengths.setdefault(str(country_code), set()).update(metadata.general_desc.possible_length)
+		_possible_lengths = lengths
+	return _possible_lengths
+
+def get_default_country_code():
+	"""Calling code of the system country, used for numbers written with a national trunk prefix.
+	"""
+	country = frappe.db.get_default('country')
+	region = country and frappe.get_cached_value('Country', country, 'code')
+	if phonenumbers and region:
+		return str(phonenumbers.country_code_for_region(region.upper())) or None
+
+def normalize_number(number, default_country_code=None):
+	"""E.164 form of a number, or None when it can't be a valid number.
+	>>> normalize_number('whatsapp:+256 770-787451')
+	... '+256770787451'
+	"""
+	normalized, _ = normalize_numbers([number], default_country_code)
+	return next(iter(normalized), None)
+
+def normalize_numbers(numbers, default_country_code=None):
+	"""Normalize a list of numbers to E.164, keeping the first occurrence of each.
+	Returns the valid numbers in their original order, mapped to the number as given,
+	and the rejected numbers with a reason.
+	>>> normalize_numbers(['+256 770 787451', '256770787451', '12345', '+0770787451', '+999123456789'])
+	... ({'+256770787451': '+256 770 787451'}, [('256770787451', 'duplicate'), ('12345', 'invalid format'),
+		('+0770787451', 'invalid format'), ('+999123456789', 'unknown country code')])
+	"""
+	possible_lengths = get_possible_lengths()
+	if default_country_code is None:
+		default_country_code = get_default_country_code()
+
+	valid, rejected = {}, []
+	for number in numbers:
+		raw = str(number or '').strip()
+		if raw.startswith('whatsapp:'):
+			raw = raw[9:]
+		cleaned = SEPARATORS.sub('', raw)
+
+		if cleaned.startswith('+'):
+			digits = cleaned[1:]
+		elif cleaned.startswith('00'):
+			digits = cleaned[2:]
+		elif cleaned.startswith('0') and default_country_code:
+			digits = default_country_code + cleaned[1:]
+		else:
+			# Numbers are often stored with the `+` stripped.
+			digits = cleaned
+
+		# No calling code starts with 0, left over trunk prefixes can't be dialled internationally.
+		if NOT_DIGITS.search(digits) or digits.startswith('0') \
+			or not (E164_MIN_DIGITS <= len(digits) <= E164_MAX_DIGITS):
+			rejected.append((number, INVALID_FORMAT))
+			continue
+
+		if possible_lengths:
+			# Calling codes are prefix free, at most one of the 1-3 digit prefixes is assigned.
+			country_code = next((digits[:i] for i in (1, 2, 3) if digits[:i] in possible_lengths), None)
+			if not country_code:
+				rejected.append((number, UNKNOWN_COUNTRY_CODE))
+				continue
+			if len(digits) - len(country_code) not in possible_lengths[country_code]:
+				rejected.append((number, INVALID_LENGTH))
+				continue
+
+		e164 = '+' + digits
+		if e164 in valid:
+			rejected.append((number, DUPLICATE))
+			continue
+
+		valid[e164] = number
+
+	return valid, rejected
+
+def log_rejected_numbers(rejected, reference_doctype=None, reference_name=None):
+	"""Record invalid numbers dropped before sending, one log for the whole batch.
+	"""
+	rejected = [(number, reason) for number, reason in rejected
+		if reason in (INVALID_FORMAT, UNKNOWN_COUNTRY_CODE, INVALID_LENGTH)]
+	if not rejected:
+		return
+
+	lines = ['{} ({})'.format(number, reason) for number, reason in rejected[:1000]]
+	if reference_doctype:
+		lines.insert(0, '{}: {}\n'.format(reference_doctype, reference_name))
+
+	frappe.log_error(
+		title='Skipped {} invalid WhatsApp numbers'.format(len(rejected)),
+		message='\n'.join(lines)
+	)
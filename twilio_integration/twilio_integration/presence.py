@@ -0,0 +1,59 @@
+import time
+
+import frappe
+
+# Redis sorted set of agents scored by the time of their last softphone heartbeat.
+PRESENCE_KEY = 'twilio_agent_presence'
+# Softphone tabs of an agent scored the same way, an agent is online while any tab is.
+PRESENCE_TABS_KEY = 'twilio_agent_presence_tabs:{}'
+# An agent without a heartbeat for this long is treated as offline.
+# Keep well above heartbeat_interval in twilio_call_handler.js.
+PRESENCE_TTL = 90
+
+
+def get_presence_key():
+	return frappe.cache().make_key(PRESENCE_KEY)
+
+def get_tabs_key(user: str):
+	return frappe.cache().make_key(PRESENCE_TABS_KEY.format(user))
+
+def mark_online(user: str, tab: str=None):
+	now = time.time()
+	pipe = frappe.cache().pipeline()
+	pipe.zadd(get_presence_key(), {user: now})
+	if tab:
+		pipe.zadd(get_tabs_key(user), {tab: now})
+		pipe.expire(get_tabs_key(user), PRESENCE_TTL)
+	pipe.execute()
+
+def mark_offline(user: str, tab: str=None):
+	"""Take a closed softphone tab out of routing. The agent stays online while
+	another of their tabs keeps reporting in.
+	"""
+	if tab:
+		tabs_key = get_tabs_key(user)
+		pipe = frappe.cache().pipeline()
+		pipe.zrem(tabs_key, tab)
+		pipe.zremrangebyscore(tabs_key, '-inf', time.time() - PRESENCE_TTL)
+		pipe.zcard(tabs_key)
+		*_, open_tabs = pipe.execute()
+		if open_tabs:
+			return
+
+	frappe.cache().zrem(get_presence_key(), user)
+
+def get_online_agents(users: list):
+	"""Filter the users whose softphone is connected, without touching the database.
+	>>> get_online_agents(['agent1@example.com', 'agent2@example.com'])
+	... ['agent2@example.com']
+	"""
+	if not users:
+		return []
+
+	pipe = frappe.cache().pipeline()
+	for user in users:
+		pipe.zscore(get_presence_key(), user)
+	last_seen = pipe.execute()
+
+	cutoff = time.time() - PRESENCE_TTL
+	return [user for user, seen in zip(users, last_seen) if seen and seen >= cutoff]
@@ -0,0 +1,150 @@
+"""Numbers WhatsApp messages must not be sent to.
+
+`WhatsApp Suppression` is mirrored into a Redis set, the exact membership test.
+Each worker also keeps a Bloom filter of the set, so the numbers of a batch are
+checked in memory and only the few that may be suppressed go to Redis. The
+filter is rebuilt when a number is added, which bumps the set's version.
+"""
+import math
+import hashlib
+
+import frappe
+from .phone_numbers import normalize_number
+
+SUPPRESSION_SET_KEY = 'whatsapp_suppression_set'
+SUPPRESSION_VERSION_KEY = 'whatsapp_suppression_version'
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+SUPPRESSED = 'suppressed'
+
+# Inbound keywords, as handled by Twilio's Advanced Opt-Out.
+# CANCEL is left out, the order chatbot uses it to abandon an order.
+OPT_OUT_KEYWORDS = ('STOP', 'STOPALL', 'UNSUBSCRIBE', 'END', 'QUIT')
+OPT_IN_KEYWORDS = ('START', 'UNSTOP', 'YES')
+# 63003: channel could not find the recipient, 21211: invalid 'To' number,
+# 21610: recipient has replied STOP.
+UNDELIVERABLE_ERROR_CODES = ('63003', '21211', '21610')
+
+# site -> (version, BloomFilter)
+_bloom_filters = {}
+
+
+class BloomFilter:
+	def __init__(self, capacity: int, false_positive_rate: float=BLOOM_FALSE_POSITIVE_RATE):
+		capacity = max(capacity, 1000)
+		self.size = int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+		self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+		self.bits = bytearray((self.size + 7) // 8)
+
+	def get_positions(self, item: str):
+		# Double hashing, k positions from the two halves of one digest.
+		digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+	def add(self, item: str):
+		for position in self.get_positions(item):
+			self.bits[position >> 3] |= 1 << (position & 7)
+
+	def __contains__(self, item: str):
+		return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(item))
+
+
+def get_key(key: str):
+	return frappe.cache().make_key(key)
+
+def load_suppression_set():
+	"""Fill the Redis set from `WhatsApp Suppression`, e.g. after the cache was cleared.
+	Returns the version of the loaded set.
+	"""
+	numbers = frappe.get_all('WhatsApp Suppression', pluck='name')
+	pipe = frappe.cache().pipeline()
+	pipe.delete(get_key(SUPPRESSION_SET_KEY))
+	if numbers:
+		pipe.sadd(get_key(SUPPRESSION_SET_KEY), *numbers)
+	pipe.incr(get_key(SUPPRESSION_VERSION_KEY))
+	return pipe.execute()[-1]
+
+def get_bloom_filter():
+	version = frappe.cache().get(get_key(SUPPRESSION_VERSION_KEY))
+	if version is None:
+		version = load_suppression_set()
+	version = int(version)
+
+	cached = _bloom_filters.get(frappe.local.site)
+	if cached and cached[0] == version:
+		return cached[1]
+
+	# RedisWrapper's set commands prefix the key themselves, pipelines don't.
+	members = frappe.cache().smembers(SUPPRESSION_SET_KEY)
+	bloom = BloomFilter(len(members))
+	for number in members:
+		bloom.add(frappe.safe_decode(number))
+	_bloom_filters[frappe.local.site] = (version, bloom)
+	return bloom
+
+def filter_suppressed(numbers: list):
+	"""Split E.164 numbers into those that can be messaged and those that are suppressed.
+	>>> filter_suppressed(['+256770787451', '+14155238886'])
+	... (['+14155238886'], ['+256770787451'])
+	"""
+	bloom = get_bloom_filter()
+	candidates = [number for number in numbers if number in bloom]
+	if not candidates:
+		return list(numbers), []
+
+	pipe = frappe.cache().pipeline()
+	for number in candidates:
+		pipe.sismember(get_key(SUPPRESSION_SET_KEY), number)
+	suppressed = {number for number, member in zip(candidates, pipe.execute()) if member}
+	return [number for number in numbers if number not in suppressed], list(suppressed)
+
+def is_suppressed(number: str):
+	return bool(filter_suppressed([number])[1])
+
+def add_to_suppression_set(number: str):
+	pipe = frappe.cache().pipeline()
+	pipe.sadd(get_key(SUPPRESSION_SET_KEY), number)
+	# Workers rebuild their filter, a number missing from it would never be checked.
+	pipe.incr(get_key(SUPPRESSION_VERSION_KEY))
+	pipe.execute()
+
+def remove_from_suppression_set(number: str):
+	# Filters are left as they are, the set itself answers for numbers still in them.
+	frappe.cache().srem(SUPPRESSION_SET_KEY, number)
+
+def suppress(number: str, reason: str, error_code=None, message_id=None):
+	number = number and normalize_number(number)
+	if not number or frappe.db.exists('WhatsApp Suppression', number):
+		return
+
+	frappe.get_doc({
+		'doctype': 'WhatsApp Suppression',
+		'whatsapp_no': number,
+		'reason': reason,
+		'error_code': error_code,
+		'message_id': message_id
+	}).insert(ignore_permissions=True)
+
+def unsuppress(number: str):
+	"""Lift an opt out when the recipient opts back in, other suppressions stay.
+	"""
+	number = number and normalize_number(number)
+	if number and frappe.db.get_value('WhatsApp Suppression', number, 'reason') == 'Opt Out':
+		frappe.delete_doc('WhatsApp Suppression', number, ignore_permissions=True)
+
+def process_inbound_keyword(from_number: str, body: str):
+	"""Opt the sender out or back in on a keyword. Returns True when the sender opted out,
+	the message needs no other handling then.
+	"""
+	keyword = (body or '').strip().upper()
+	if keyword in OPT_OUT_KEYWORDS:
+		suppress(from_number, 'Opt Out')
+		return True
+	elif keyword in OPT_IN_KEYWORDS:
+		unsuppress(from_number)
+	return False
+
+def process_delivery_error(to_number: str, error_code, message_id=None):
+	if error_code and str(error_code) in UNDELIVERABLE_ERROR_CODES:
+		suppress(to_number, 'Undeliverable', error_code=str(error_code), message_id=message_id)
@@ -1,14 +1,27 @@
 import re
 import json
+import time
+from urllib.parse import urlencode
 from twilio.rest import Client as TwilioClient
 from twilio.jwt.access_token import AccessToken
 from twilio.jwt.access_token.grants import VoiceGrant
-from twilio.twiml.voice_response import VoiceResponse, Dial
 
 import frappe
 from frappe import _
 from frappe.utils.password import get_decrypted_password
 from .utils import get_public_url, merge_dicts
+from .presence import get_online_agents
+from .call_distribution import get_call_attenders
+from . import twiml
+from .caller_lookup import warm_caller_summary
+from . import call_queue
+
+VOICE_TOKEN_TTL = 60 * 60
+# Tokens are handed out again until this many seconds before they expire.
+VOICE_TOKEN_REFRESH_MARGIN = 5 * 60
+VOICE_TOKEN_CACHE_KEY = 'twilio_voice_access_token'
+RECORDING_CALLBACK_URL_CACHE_KEY = 'twilio_recording_status_callback_url'
+AGENT_CALL_STATUS_PATH = "/api/method/twilio_integration.twilio_integration.api.voice.agent_call_status"
 
 class Twilio:
 	"""Twilio connector over TwilioClient.
@@ -21,14 +34,28 @@ class Twilio:
 		self.account_sid = settings.account_sid
 		self.application_sid = settings.twiml_sid
 		self.api_key = settings.api_key
-		self.api_secret = settings.get_password("api_secret")
-		self.twilio_client = self.get_twilio_client()
+		self._twilio_client = None
+
+	@property
+	def api_secret(self):
+		"""Decrypted only when a token is signed, TwiML responses don't need it.
+		"""
+		return self.settings.get_password("api_secret")
+
+	@property
+	def twilio_client(self):
+		"""REST client, built on first use as token and TwiML generation don't need it.
+		"""
+		if not self._twilio_client:
+			self._twilio_client = self.get_twilio_client()
+		return self._twilio_client
 
 	@classmethod
 	def connect(self):
 		"""Make a twilio connection.
+		Settings come from the document cache, which is cleared whenever they are saved.
 		"""
-		settings = frappe.get_doc("Twilio Settings")
+		settings = frappe.get_cached_doc("Twilio Settings")
 		if not (settings and settings.enabled):
 			return
 		return Twilio(settings=settings)
@@ -39,7 +66,7 @@ class Twilio:
 		numbers = self.twilio_client.incoming_phone_numbers.list()
 		return [n.phone_number for n in numbers]
 
-	def generate_voice_access_token(self, from_number: str, identity: str, ttl=60*60):
+	def generate_voice_access_token(self, from_number: str, identity: str, ttl=VOICE_TOKEN_TTL):
 		"""Generates a token required to make voice calls from the browser.
 		"""
 		# identity is used by twilio to identify the user uniqueness at browser(or any endpoints).
@@ -71,22 +98,53 @@ class Twilio:
 		return identity.replace('(at)', '@')
 
 	def get_recording_status_callback_url(self):
-		url_path = "/api/method/twilio_integration.twilio_integration.api.update_recording_info"
-		return get_public_url(url_path)
+		"""Public URL of the recording callback, computed once and shared across requests.
+		"""
+		def _get_url():
+			url_path = "/api/method/twilio_integration.twilio_integration.api.voice.update_recording_info"
+			return get_public_url(url_path)
+		return frappe.cache().get_value(RECORDING_CALLBACK_URL_CACHE_KEY, generator=_get_url)
 
 	def generate_twilio_dial_response(self, from_number: str, to_number: str):
 		"""Generates voice call instructions to forward the call to agents Phone.
 		"""
-		resp = VoiceResponse()
-		dial = Dial(
+		return twiml.dial_number(
+			to_number,
 			caller_id=from_number,
 			record=self.settings.record_calls,
-			recording_status_callback=self.get_recording_status_callback_url(),
-			recording_status_callback_event='completed'
+			callback=self.get_recording_status_callback_url()
+		)
+
+	def generate_twilio_attenders_response(self, from_number: str, to_number: str, attenders: list, ring_tone='at', action=None):
+		"""Generates voice call instructions to ring the attenders on their Phone or computer at once.
+		Each leg reports its status back so that agents are tracked as busy while on the call.
+		"""
+		nouns = []
+		for attender in attenders:
+			status_callback = get_public_url('{}?{}'.format(AGENT_CALL_STATUS_PATH, urlencode({'agent': attender['name'], 'twilio_number': to_number})))
+			if attender['call_receiving_device'] == 'Phone':
+				nouns.append(twiml.noun('Number', attender['mobile_no'], status_callback))
+			else:
+				nouns.append(twiml.noun('Client', self.safe_identity(attender['name']), status_callback))
+
+		return twiml.dial(
+			nouns,
+			record=self.settings.record_calls,
+			callback=self.get_recording_status_callback_url(),
+			caller_id=from_number,
+			ring_tone=ring_tone,
+			action=action
+		)
+
+	def generate_twilio_enqueue_response(self, to_number: str):
+		"""Generates voice call instructions to hold the caller in the number's queue.
+		"""
+		hold_music_url = self.settings.hold_music_url
+		return twiml.enqueue(
+			call_queue.get_queue_name(to_number),
+			action=get_public_url(call_queue.QUEUE_LEFT_PATH),
+			wait_url=hold_music_url and get_public_url(call_queue.QUEUE_HOLD_PATH)
 		)
-		dial.number(to_number)
-		resp.append(dial)
-		return resp
 
 	def get_call_info(self, call_sid):
 		return self.twilio_client.calls(call_sid).fetch()
@@ -94,16 +152,12 @@ class Twilio:
 	def generate_twilio_client_response(self, client, ring_tone='at'):
 		"""Generates voice call instructions to forward the call to agents computer.
 		"""
-		resp = VoiceResponse()
-		dial = Dial(
-			ring_tone=ring_tone,
+		return twiml.dial_client(
+			client,
 			record=self.settings.record_calls,
-			recording_status_callback=self.get_recording_status_callback_url(),
-			recording_status_callback_event='completed'
+			callback=self.get_recording_status_callback_url(),
+			ring_tone=ring_tone
 		)
-		dial.client(client)
-		resp.append(dial)
-		return resp
 
 	@classmethod
 	def get_twilio_client(self):
@@ -116,11 +170,41 @@ class Twilio:
 
 		return client
 
+def get_voice_access_token(user: str, from_number: str):
+	"""Signed voice token of the user, reused from cache until it is close to expiry.
+	>>> get_voice_access_token('agent@example.com', '+11234567890')
+	... {'token': 'eyJ..', 'expires_in': 3600, 'refresh_in': 3300}
+	"""
+	now = int(time.time())
+	cached = frappe.cache().hget(VOICE_TOKEN_CACHE_KEY, user)
+	if not (cached and cached['expires_on'] - now > VOICE_TOKEN_REFRESH_MARGIN):
+		twilio = Twilio.connect()
+		if not twilio:
+			return
+
+		token = twilio.generate_voice_access_token(from_number=from_number, identity=user)
+		cached = {'token': frappe.safe_decode(token), 'expires_on': now + VOICE_TOKEN_TTL}
+		frappe.cache().hset(VOICE_TOKEN_CACHE_KEY, user, cached)
+
+	expires_in = cached['expires_on'] - now
+	return {
+		'token': cached['token'],
+		'expires_in': expires_in,
+		'refresh_in': expires_in - VOICE_TOKEN_REFRESH_MARGIN
+	}
+
+def clear_voice_access_tokens():
+	frappe.cache().delete_value(VOICE_TOKEN_CACHE_KEY)
+
+def clear_recording_callback_url():
+	frappe.cache().delete_value(RECORDING_CALLBACK_URL_CACHE_KEY)
+
 class IncomingCall:
-	def __init__(self, from_number, to_number, meta=None):
+	def __init__(self, from_number, to_number, meta=None, call_sid=None):
 		self.from_number = from_number
 		self.to_number = to_number
 		self.meta = meta
+		self.call_sid = call_sid
 
 	def process(self):
 		"""Process the incoming call
@@ -129,17 +213,26 @@ class IncomingCall:
 		"""
 		twilio = Twilio.connect()
 		owners = get_twilio_number_owners(self.to_number)
-		attender = get_the_call_attender(owners)
+		attenders = get_the_call_attenders(owners, self.to_number)
+		# Have the caller details ready before the agent's popup asks for them.
+		warm_caller_summary(self.from_number)
+
+		queue_enabled = self.call_sid and call_queue.is_call_queue_enabled()
 
-		if not attender:
-			resp = VoiceResponse()
-			resp.say(_('Agent is unavailable to take the call, please call after some time.'))
-			return resp
+		if not attenders:
+			if queue_enabled:
+				return self.requeue()
+			return twiml.say(_('Agent is unavailable to take the call, please call after some time.'))
 
-		if attender['call_receiving_device'] == 'Phone':
-			return twilio.generate_twilio_dial_response(self.from_number, attender['mobile_no'])
-		else:
-			return twilio.generate_twilio_client_response(twilio.safe_identity(attender['name']))
+		# Calls nobody answers come back through the dequeued call handler and wait in the queue.
+		action = queue_enabled and get_public_url(call_queue.DEQUEUED_CALL_PATH)
+		return twilio.generate_twilio_attenders_response(self.from_number, self.to_number, attenders, action=action)
+
+	def requeue(self):
+		"""Put the caller (back) in the queue of the number.
+		"""
+		call_queue.add_to_queue(self.call_sid, self.to_number)
+		return Twilio.connect().generate_twilio_enqueue_response(self.to_number)
 
 class TwilioCallDetails:
 	def __init__(self, call_info, call_from = None, call_to = None):
@@ -206,22 +299,12 @@ def get_twilio_number_owners(phone_number):
 	return merge_dicts(user_wise_general_settings, user_wise_voice_settings)
 
 
-def get_active_loggedin_users(users):
-	"""Filter the current loggedin users from the given users list
-	"""
-	rows = frappe.db.sql("""
-		SELECT `user`
-		FROM `tabSessions`
-		WHERE `user` IN %(users)s
-		""", {'users': users})
-	return [row[0] for row in set(rows)]
-
-def get_the_call_attender(owners):
-	"""Get attender details from list of owners
+def get_the_call_attenders(owners, twilio_number):
+	"""Get details of the owners to ring, chosen by the configured distribution strategy.
 	"""
-	if not owners: return
-	current_loggedin_users = get_active_loggedin_users(list(owners.keys()))
-	for name, details in owners.items():
+	if not owners: return []
+	online_agents = get_online_agents(list(owners.keys()))
+	eligible = [name for name, details in owners.items()
 		if ((details['call_receiving_device'] == 'Phone' and details['mobile_no']) or
-			(details['call_receiving_device'] == 'Computer' and name in current_loggedin_users)):
-			return details
+			(details['call_receiving_device'] == 'Computer' and name in online_agents))]
+	return get_call_attenders(owners, eligible, twilio_number)
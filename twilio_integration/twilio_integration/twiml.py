@@ -0,0 +1,78 @@
+"""Prebuilt TwiML responses for the voice webhooks.
+
+Voice webhooks only ever answer with a handful of fixed shapes, so they are kept
+as string templates instead of being assembled with `VoiceResponse` on every call.
+"""
+from xml.sax.saxutils import escape, quoteattr
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+DIAL_TEMPLATE = (XML_DECLARATION
+	+ '<Response><Dial{attributes} record="{record}" recordingStatusCallback={callback}'
+	+ ' recordingStatusCallbackEvent="completed">{nouns}</Dial></Response>')
+
+SAY_TEMPLATE = XML_DECLARATION + '<Response><Say>{text}</Say></Response>'
+
+ENQUEUE_TEMPLATE = XML_DECLARATION + '<Response><Enqueue{attributes}>{queue}</Enqueue></Response>'
+
+PLAY_TEMPLATE = XML_DECLARATION + '<Response><Play loop="0">{url}</Play></Response>'
+
+EMPTY_RESPONSE = XML_DECLARATION + '<Response></Response>'
+
+
+def attributes(**kwargs):
+	"""Render tag attributes, skipping empty values.
+	>>> attributes(callerId='+11234567890', ringTone=None)
+	... ' callerId="+11234567890"'
+	"""
+	return ''.join(' {}={}'.format(name, quoteattr(str(value))) for name, value in kwargs.items() if value)
+
+def noun(tag: str, value: str, status_callback: str=None):
+	"""A <Number> or <Client> to dial, reporting its own leg's status when a callback is given.
+	>>> noun('Client', 'agent(at)example.com', 'https://site/api/method/..agent_call_status?agent=..')
+	... '<Client statusCallback=".." statusCallbackEvent="answered completed">agent(at)example.com</Client>'
+	"""
+	return '<{tag}{attributes}>{value}</{tag}>'.format(
+		tag=tag,
+		attributes=attributes(
+			statusCallback=status_callback,
+			statusCallbackEvent=status_callback and 'answered completed'
+		),
+		value=escape(value or '')
+	)
+
+def dial(nouns: list, record: bool, callback: str, caller_id: str=None, ring_tone: str=None, action: str=None):
+	"""Dial every noun at once, the first leg to answer gets the call.
+	"""
+	return DIAL_TEMPLATE.format(
+		attributes=attributes(callerId=caller_id, ringTone=ring_tone, action=action),
+		record='record-from-answer' if record else 'do-not-record',
+		callback=quoteattr(callback),
+		nouns=''.join(nouns)
+	)
+
+def dial_number(number: str, caller_id: str, record: bool, callback: str):
+	"""Forward the call to a phone number.
+	"""
+	return dial([noun('Number', number)], record, callback, caller_id=caller_id)
+
+def dial_client(client: str, record: bool, callback: str, ring_tone: str='at'):
+	"""Forward the call to an agent's browser softphone.
+	"""
+	return dial([noun('Client', client)], record, callback, ring_tone=ring_tone)
+
+def say(text: str):
+	return SAY_TEMPLATE.format(text=escape(text))
+
+def enqueue(queue: str, action: str, wait_url: str=None):
+	"""Put the caller in a named Twilio queue, Twilio plays its default hold music without a `wait_url`.
+	"""
+	return ENQUEUE_TEMPLATE.format(
+		attributes=attributes(action=action, waitUrl=wait_url),
+		queue=escape(queue)
+	)
+
+def play(url: str):
+	"""Play audio in a loop, used as hold music.
+	"""
+	return PLAY_TEMPLATE.format(url=escape(url))